@@ -0,0 +1,96 @@
+import numpy as np
+
+
+class BlockSumPyramid:
+    """
+    Summed diffraction patterns over aligned 2x2, 4x4, 8x8, ... real-space
+    blocks of a cube.
+
+    A rectangle of scan positions is decomposed into the largest aligned
+    blocks that fit inside it, plus smaller blocks and finally single frames
+    along its edges, so the mean DP of a large ROI touches only a handful of
+    precomputed sums instead of every frame.
+    """
+
+    def __init__(self, processor, max_level=None, dtype=np.float32):
+        self.processor = processor
+        self.dtype = dtype
+        shape = processor.get_shape()
+        self.scan_shape = tuple(shape[:2])
+        self.detector_shape = tuple(shape[2:])
+        if max_level is None:
+            max_level = int(np.log2(max(min(self.scan_shape), 1)))
+        self.max_level = max_level
+        # levels[k - 1] holds the sums over 2**k x 2**k blocks
+        self.levels = []
+
+    @property
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels)
+
+    def build(self, progress_callback=None):
+        """
+        Build all levels in one pass over the cube.
+        ``progress_callback(done_rows, total_rows)`` is called per chunk.
+        """
+        if self.max_level < 1:
+            return self
+        ny, nx = self.scan_shape
+        first = np.zeros((ny // 2, nx // 2) + self.detector_shape, dtype=self.dtype)
+        # Chunks must start on even rows so that 2x2 blocks do not straddle them
+        chunk_rows = max(2, self.processor.get_chunk_rows() // 2 * 2)
+        for y0 in range(0, ny - ny % 2, chunk_rows):
+            y1 = min(y0 + chunk_rows, ny - ny % 2)
+            block = self.processor.get_frames(y0, y1, 0, nx - nx % 2)
+            first[y0 // 2 : y1 // 2] = _sum_2x2(block, self.dtype)
+            if progress_callback is not None:
+                progress_callback(y1, ny)
+        self.levels = [first]
+        for _ in range(1, self.max_level):
+            previous = self.levels[-1]
+            if min(previous.shape[:2]) < 2:
+                break
+            h, w = previous.shape[0] // 2 * 2, previous.shape[1] // 2 * 2
+            self.levels.append(_sum_2x2(previous[:h, :w], self.dtype))
+        return self
+
+    def rect_sum(self, y0, y1, x0, x1):
+        """Sum and number of the frames in scan rows y0:y1, columns x0:x1."""
+        total = np.zeros(self.detector_shape, dtype=np.float64)
+        count = self._add_rect(total, y0, y1, x0, x1, len(self.levels))
+        return total, count
+
+    def rect_mean(self, y0, y1, x0, x1):
+        total, count = self.rect_sum(y0, y1, x0, x1)
+        return total / count
+
+    def _add_rect(self, total, y0, y1, x0, x1, level):
+        if y0 >= y1 or x0 >= x1:
+            return 0
+        if level == 0:
+            frames = self.processor.get_frames(y0, y1, x0, x1)
+            total += frames.sum(axis=(0, 1), dtype=np.float64)
+            return (y1 - y0) * (x1 - x0)
+
+        size = 2**level
+        sums = self.levels[level - 1]
+        by0, by1 = -(-y0 // size), min(y1 // size, sums.shape[0])
+        bx0, bx1 = -(-x0 // size), min(x1 // size, sums.shape[1])
+        if by0 >= by1 or bx0 >= bx1:
+            return self._add_rect(total, y0, y1, x0, x1, level - 1)
+
+        total += sums[by0:by1, bx0:bx1].sum(axis=(0, 1), dtype=np.float64)
+        count = (by1 - by0) * (bx1 - bx0) * size * size
+        # Cover the rest of the rectangle with the strips around the core
+        cy0, cy1, cx0, cx1 = by0 * size, by1 * size, bx0 * size, bx1 * size
+        count += self._add_rect(total, y0, cy0, x0, x1, level - 1)
+        count += self._add_rect(total, cy1, y1, x0, x1, level - 1)
+        count += self._add_rect(total, cy0, cy1, x0, cx0, level - 1)
+        count += self._add_rect(total, cy0, cy1, cx1, x1, level - 1)
+        return count
+
+
+def _sum_2x2(block, dtype):
+    rows, cols = block.shape[0] // 2, block.shape[1] // 2
+    blocks = block.reshape((rows, 2, cols, 2) + block.shape[2:])
+    return blocks.sum(axis=(1, 3), dtype=dtype)
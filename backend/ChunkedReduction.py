@@ -0,0 +1,88 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+MAX_WORKERS = int(os.environ.get("PYGLASS_THREADS", os.cpu_count() or 1))
+# Size of the block each worker reads. Blocks are whole scan rows, so one
+# can be larger; fewer of those run at once, which bounds the memory in
+# flight (counted as float64, the widest temporaries the reductions make)
+# to about MAX_WORKERS * WORKER_CHUNK_BYTES or a single block.
+WORKER_CHUNK_BYTES = 16 * 1024**2
+
+
+class ChunkedReducer:
+    """
+    Shared thread pool for reductions over the scan rows of a cube.
+
+    The cube is split into blocks of scan rows and each block is read and
+    reduced on a worker thread (NumPy releases the GIL in the heavy loops).
+    Callers combine the partial results, or write them into disjoint slices
+    of a preallocated output.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, chunk_bytes=WORKER_CHUNK_BYTES):
+        self.max_workers = max_workers
+        self.chunk_bytes = chunk_bytes
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="pyglass-reduce"
+        )
+
+    def workers_for(self, item_bytes):
+        """Tasks of ``item_bytes`` each that may run at once."""
+        budget = self.max_workers * self.chunk_bytes
+        return max(1, min(self.max_workers, budget // max(int(item_bytes), 1)))
+
+    def map(self, fn, items, item_bytes=0):
+        """
+        ``[fn(item) for item in items]``, run on the pool. ``item_bytes`` is
+        the memory one call holds; large items run fewer at a time.
+        """
+        items = list(items)
+        workers = self.workers_for(item_bytes)
+        if workers == 1 or len(items) <= 1:
+            return [fn(item) for item in items]
+        results = []
+        pending = deque()
+        for item in items:
+            if len(pending) == workers:
+                results.append(pending.popleft().result())
+            pending.append(self._executor.submit(fn, item))
+        results.extend(future.result() for future in pending)
+        return results
+
+    def row_ranges(self, processor, chunk_rows=None):
+        if chunk_rows is None:
+            chunk_rows = max(1, self.chunk_bytes // self.rows_bytes(processor, 1))
+        n_rows = processor.get_shape()[0]
+        return [
+            (y0, min(y0 + chunk_rows, n_rows)) for y0 in range(0, n_rows, chunk_rows)
+        ]
+
+    def rows_bytes(self, processor, n_rows):
+        """Memory of ``n_rows`` scan rows of a cube, counted as float64."""
+        return n_rows * int(np.prod(processor.get_shape()[1:])) * 8
+
+    def map_row_ranges(self, processor, fn, chunk_rows=None):
+        """``fn((y0, y1))`` for every block of scan rows, in row order."""
+        ranges = self.row_ranges(processor, chunk_rows)
+        if not ranges:
+            return []
+        item_bytes = self.rows_bytes(processor, ranges[0][1] - ranges[0][0])
+        return self.map(fn, ranges, item_bytes)
+
+    def map_rows(self, processor, fn, chunk_rows=None):
+        """
+        Call ``fn(y0, y1, block)`` for every block of scan rows of a
+        DM4Processor and return the results in row order.
+        """
+
+        def run(rows):
+            y0, y1 = rows
+            return fn(y0, y1, processor.get_rows(y0, y1))
+
+        return self.map_row_ranges(processor, run, chunk_rows)
+
+
+Chunked_Reducer = ChunkedReducer()
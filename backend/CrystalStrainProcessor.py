@@ -43,11 +43,15 @@ class CrystalStrainProcessor:
         "_get_strain_params",
     ]
 
-    def load_data(self, data):
+    def load_data(self, data, stats=None):
         self.datacube = py4DSTEM.DataCube(data)
 
-        self._dp_mean = self.datacube.get_dp_mean()
-        self._dp_max = self.datacube.get_dp_max()
+        if stats is not None:
+            # Reuse the shared CubeStatistics instead of another pass
+            self._dp_mean, self._dp_max = stats.attach_to(self.datacube)
+        else:
+            self._dp_mean = self.datacube.get_dp_mean()
+            self._dp_max = self.datacube.get_dp_max()
         self._radius_bf = None
         self._guess_center = None
         self._geometry_bf = None
@@ -0,0 +1,133 @@
+import threading
+
+import numpy as np
+import py4DSTEM
+
+from ChunkedReduction import Chunked_Reducer
+from Histogram import Histogram
+
+# Arrays that make up a CubeStatistics, in the order they are persisted
+FIELDS = (
+    "count",
+    "mean_dp",
+    "m2_dp",
+    "max_dp",
+    "total_intensity",
+    "frame_min",
+    "frame_max",
+    "hist_grid",
+    "hist_counts",
+)
+
+
+class CubeStatistics:
+    """
+    Streaming summary statistics of a 4D cube.
+
+    Fed one block of scan rows at a time, it produces the mean, max and
+    variance diffraction patterns, the total-intensity map, the per-frame
+    min/max and the intensity histogram of the cube in a single pass.
+    Partial results from disjoint blocks can be merged, and ``update`` may be
+    called from several worker threads.
+    """
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.count = 0
+        self.mean_dp = np.zeros(self.shape[2:], dtype=np.float64)
+        self.m2_dp = np.zeros(self.shape[2:], dtype=np.float64)
+        self.max_dp = None
+        self.total_intensity = np.zeros(self.shape[:2], dtype=np.float64)
+        self.frame_min = np.zeros(self.shape[:2], dtype=np.float64)
+        self.frame_max = np.zeros(self.shape[:2], dtype=np.float64)
+        self.histogram = Histogram()
+        self._lock = threading.Lock()
+
+    @property
+    def hist_grid(self):
+        return self.histogram.as_arrays()[0]
+
+    @property
+    def hist_counts(self):
+        return self.histogram.counts
+
+    @property
+    def var_dp(self):
+        if self.count == 0:
+            return np.zeros_like(self.m2_dp)
+        return self.m2_dp / self.count
+
+    def update(self, y0, y1, block):
+        """Add the frames ``block = data[y0:y1]`` to the statistics."""
+        self.total_intensity[y0:y1] = block.sum(axis=(2, 3), dtype=np.float64)
+        self.frame_min[y0:y1] = block.min(axis=(2, 3))
+        self.frame_max[y0:y1] = block.max(axis=(2, 3))
+
+        n = block.shape[0] * block.shape[1]
+        mean = block.mean(axis=(0, 1), dtype=np.float64)
+        m2 = ((block - mean) ** 2).sum(axis=(0, 1))
+        block_max = block.max(axis=(0, 1))
+        histogram = Histogram.of(block)
+        # Per-frame maps above are disjoint slices; only the DP moments and
+        # the histogram are shared
+        with self._lock:
+            self._combine(n, mean, m2, block_max)
+            self.histogram = self.histogram.merge(histogram)
+
+    def merge(self, other):
+        """Merge statistics computed over a disjoint set of scan rows."""
+        # Per-frame maps are zero outside the rows each side has seen
+        self.total_intensity += other.total_intensity
+        self.frame_min += other.frame_min
+        self.frame_max += other.frame_max
+        if other.count:
+            with self._lock:
+                self._combine(other.count, other.mean_dp, other.m2_dp, other.max_dp)
+                self.histogram = self.histogram.merge(other.histogram)
+
+    def _combine(self, n, mean, m2, max_dp):
+        # Chan et al. parallel update of mean and sum of squared deviations
+        total = self.count + n
+        delta = mean - self.mean_dp
+        self.mean_dp += delta * (n / total)
+        self.m2_dp += m2 + delta**2 * (self.count * n / total)
+        self.count = total
+        if self.max_dp is None:
+            self.max_dp = np.array(max_dp)
+        else:
+            np.maximum(self.max_dp, max_dp, out=self.max_dp)
+
+    def as_dict(self):
+        return {name: np.asarray(getattr(self, name)) for name in FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        shape = tuple(data["total_intensity"].shape) + tuple(data["mean_dp"].shape)
+        stats = cls(shape)
+        for name in FIELDS[: FIELDS.index("hist_grid")]:
+            setattr(stats, name, np.asarray(data[name]))
+        stats.count = int(stats.count)
+        # Statistics cached before histograms were added have none
+        if "hist_counts" in data:
+            stats.histogram = Histogram.from_arrays(
+                data["hist_grid"], data["hist_counts"]
+            )
+        return stats
+
+    def attach_to(self, datacube):
+        """
+        Attach the mean and max DP to a py4DSTEM DataCube under the names
+        ``get_dp_mean``/``get_dp_max`` would use, and return them.
+        """
+        dp_mean = py4DSTEM.VirtualDiffraction(data=self.mean_dp, name="dp_mean")
+        dp_max = py4DSTEM.VirtualDiffraction(data=self.max_dp, name="dp_max")
+        datacube.attach(dp_mean)
+        datacube.attach(dp_max)
+        return dp_mean, dp_max
+
+
+def compute_statistics(processor):
+    """Compute the CubeStatistics of a loaded DM4Processor in one threaded pass."""
+    stats = CubeStatistics(processor.get_shape())
+    Chunked_Reducer.map_rows(processor, stats.update)
+    return stats
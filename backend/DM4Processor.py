@@ -1,37 +1,198 @@
 from ncempy.io import dm
+import itertools
 import numpy as np
 import os
 import py4DSTEM
+import dask.array as da
 import hyperspy.api as hs
 
+from BlockPyramid import BlockSumPyramid
+from ChunkedReduction import Chunked_Reducer
+from CubeStatistics import CubeStatistics, compute_statistics
+from IngestCache import DERIVED_KEYS, Ingest_Cache
+from SpillFiles import Spill_Files
+
+# Files larger than this are opened lazily (memory-mapped) when ``lazy`` is None
+LAZY_LOAD_THRESHOLD = 1024**3
+# Target size of the blocks read by chunked passes over the cube
+CHUNK_BYTES = 64 * 1024**2
+# Detector binning factors offered for interactive previews, coarsest first
+PREVIEW_BINNING = (4, 2)
+# Binning used for draft reductions (virtual images, ROI means) while editing
+DRAFT_BINNING = 4
+# Cubes from this size on show a draft of each reduction before the result
+PROGRESSIVE_BYTES = 256 * 1024**2
+# Scan positions averaged by the draft of a rectangle mean
+DRAFT_FRAMES = 256
+# Process-wide counter, so a load id identifies one loaded state of one dataset
+_load_ids = itertools.count()
+
 
 def normalize(data):
     return (data - np.min(data)) / (np.max(data) - np.min(data))
 
 
+def rows_per_chunk(shape, itemsize, chunk_bytes=CHUNK_BYTES):
+    """Number of scan rows of a 4D cube that fit in ``chunk_bytes``."""
+    row_bytes = int(np.prod(shape[1:])) * itemsize
+    return max(1, chunk_bytes // max(row_bytes, 1))
+
+
+def bin_detector(block, factor):
+    """Mean over ``factor`` x ``factor`` detector pixels of a stack of frames."""
+    h = block.shape[-2] // factor
+    w = block.shape[-1] // factor
+    block = block[..., : h * factor, : w * factor]
+    blocks = block.reshape(block.shape[:-2] + (h, factor, w, factor))
+    return blocks.mean(axis=(-3, -1), dtype=np.float32)
+
+
+def read_file(file_path, lazy=False):
+    """
+    Read a 4D-STEM file. With ``lazy`` the returned array is memory-mapped,
+    so only the frames that are indexed are read from disk.
+    """
+    ext = os.path.splitext(file_path)[1]
+    if ext == ".mib" or ext == ".raw":
+        datacube = py4DSTEM.import_file(
+            filepath=file_path, mem="MEMMAP" if lazy else "RAM"
+        )
+        return datacube.data
+    if ext == ".dm4":
+        if lazy:
+            with dm.fileDM(file_path) as f:
+                return f.getMemmap(0)
+        return dm.dmReader(file_path)["data"]
+    if ext == ".npy":
+        return np.load(file_path, mmap_mode="r" if lazy else None)
+    raise ValueError(f"Unsupported file type: {ext}")
+
+
+class BinnedFrames:
+    """
+    Frames of ``processor`` binned by ``factor`` one at a time. Stands in for
+    ``processor.get_binned(factor)`` in single-frame views until that cube
+    has been built, so showing one frame never needs a pass over the cube.
+    """
+
+    def __init__(self, processor, factor):
+        self.processor = processor
+        self.factor = factor
+        self.stats = None
+        self._source_id = None
+        self._load_id = None
+
+    @property
+    def load_id(self):
+        # Own id, renewed whenever the frames of the processor change
+        if self._source_id != self.processor.load_id:
+            self._source_id = self.processor.load_id
+            self._load_id = next(_load_ids)
+        return self._load_id
+
+    @property
+    def centred_data(self):
+        return self.processor.centred_data
+
+    @property
+    def x_range(self):
+        return self.processor.x_range
+
+    def get_shape(self):
+        shape = self.processor.get_shape()
+        return shape[:2] + (shape[2] // self.factor, shape[3] // self.factor)
+
+    def get_img(self, img_index):
+        return bin_detector(self.processor.get_img(img_index), self.factor)
+
+
 class DM4Processor:
     def __init__(self):
         self.raw_data = None
+        self.lazy = False
+        self.mean_img = None
+        self.max_img = None
+        self.shifts = None
+        self.stats = None
+        self.pyramid = None
+        self._binned = {}
+        self._binned_paths = []
+        self._frame_views = {}
+        self._dp = None
+        self._norm = None
+        self._cache_file = None
+        self._cache_options = None
+        self.centred_data = None
+        self._centred_path = None
+        self._centring = False
+        self._load_id = next(_load_ids)
 
     def clear(self):
-        pass
-
-    def load_file(self, file_path, is_normalize=False):
-        if (
-            os.path.splitext(file_path)[1] == ".mib"
-            or os.path.splitext(file_path)[1] == ".raw"
-        ):
-            datacube = py4DSTEM.import_file(filepath=file_path)
-            self.raw_data = datacube.data
-            self.y_range = self.raw_data.shape[0]
-            self.x_range = self.raw_data.shape[1]
-        if os.path.splitext(file_path)[1] == ".dm4":
-            dm4 = dm.dmReader(file_path)
-            self.raw_data = dm4["data"]
-            self.y_range = dm4["data"].shape[0]
-            self.x_range = dm4["data"].shape[1]
-        if os.path.splitext(file_path)[1] == ".npy":
-            self.raw_data = np.load(file_path)
+        # Invalidates a centring job that is still running on the old data
+        self._load_id = next(_load_ids)
+        self._centring = False
+        # The signal maps the centred file; drop every array before the files
+        self._dp = None
+        self.centred_data = None
+        self.raw_data = None
+        self.mean_img = None
+        self.max_img = None
+        self.shifts = None
+        self.stats = None
+        self.pyramid = None
+        self._norm = None
+        self._reset_binned()
+        Spill_Files.remove([self._centred_path])
+        self._centred_path = None
+        if self._cache_file is not None:
+            self._cache_file.close()
+        self._cache_file = None
+        self._cache_options = None
+
+    @classmethod
+    def from_array(cls, data):
+        """Processor over an in-memory 4D array, e.g. a binned preview cube."""
+        processor = cls()
+        processor.raw_data = data
+        processor.y_range = data.shape[0]
+        processor.x_range = data.shape[1]
+        return processor
+
+    def load_file(
+        self,
+        file_path,
+        is_normalize=False,
+        lazy=None,
+        normalize_dtype=None,
+        use_cache=True,
+    ):
+        """
+        Load a 4D-STEM dataset.
+
+        With ``is_normalize`` the intensities are rescaled to the full range of
+        ``normalize_dtype``: [0, 1] for float types, [0, iinfo.max] for
+        integer types. ``normalize_dtype=None`` keeps the detector's dtype.
+
+        With ``use_cache`` the ingested cube and its derived products are read
+        from / written to the ingest cache, so reopening a file skips parsing,
+        direct-beam fitting and the mean/max reductions.
+        """
+        self.clear()
+        if lazy is None:
+            lazy = os.path.getsize(file_path) > LAZY_LOAD_THRESHOLD
+        self.lazy = lazy
+        if normalize_dtype is not None:
+            normalize_dtype = np.dtype(normalize_dtype)
+        options = {
+            "is_normalize": is_normalize,
+            "normalize_dtype": str(normalize_dtype),
+        }
+        if use_cache and self._load_cached(file_path, options):
+            return
+        if use_cache:
+            self._cache_options = (file_path, options)
+
+        self.raw_data = read_file(file_path, lazy)
         if self.raw_data.ndim == 2:
             self.raw_data = self.raw_data.reshape(
                 1, 1, self.raw_data.shape[0], self.raw_data.shape[1]
@@ -46,26 +207,423 @@ class DM4Processor:
         self.x_range = self.raw_data.shape[1]
 
         if is_normalize:
-            self.raw_data = self.raw_data.astype(np.float64)
-            self.raw_data = normalize(self.raw_data)
-            
-        self.dp = hs.signals.Signal2D(self.raw_data)
-        self.dp.set_signal_type("electron_diffraction")
-        self.dp.center_direct_beam(method="blur", half_square_width=50, sigma=1.5)
-        self.dp.calibration.center=None
+            self._normalize(normalize_dtype)
+        # Direct-beam centring is left to center_direct_beam, which callers
+        # run in the background; the raw frames are viewable right away.
+
+    def _load_cached(self, file_path, options):
+        cached = Ingest_Cache.open(file_path, **options)
+        if cached is None:
+            return False
+        if self.lazy:
+            self._cache_file = cached
+            self.raw_data = cached["data"]
+        else:
+            self.raw_data = cached["data"][()]
+        for key, attr in DERIVED_KEYS.items():
+            if key in cached:
+                setattr(self, attr, cached[key][()])
+        if "stats" in cached:
+            group = cached["stats"]
+            self.stats = CubeStatistics.from_dict({k: group[k][()] for k in group})
+        if not self.lazy:
+            cached.close()
+        self.y_range = self.raw_data.shape[0]
+        self.x_range = self.raw_data.shape[1]
+        return True
+
+    def _normalize(self, dtype=None):
+        """
+        Streaming min/max pass followed by a chunked rescale. The scale is
+        applied in place when possible, into a single output array when the
+        dtype changes, and at read time for read-only memory maps.
+        """
+        dtype = self.raw_data.dtype if dtype is None else np.dtype(dtype)
+        # Python floats: the range of signed data overflows its own dtype
+        lo, hi = np.inf, -np.inf
+        for _, _, block in self.iter_row_blocks():
+            lo = min(lo, float(block.min()))
+            hi = max(hi, float(block.max()))
+        top = np.iinfo(dtype).max if np.issubdtype(dtype, np.integer) else 1.0
+        scale = top / (hi - lo) if hi > lo else 0.0
+        self._norm = (lo, scale, dtype)
+
+        if self.lazy:
+            return
+        if dtype == self.raw_data.dtype and self.raw_data.flags.writeable:
+            out = self.raw_data
+        else:
+            out = np.empty(self.raw_data.shape, dtype=dtype)
+        # iter_row_blocks applies self._norm to each block
+        for y0, y1, block in self.iter_row_blocks():
+            out[y0:y1] = block
+        self.raw_data = out
+        self._norm = None
+
+    def _apply_norm(self, block):
+        if self._norm is None:
+            return block
+        lo, scale, dtype = self._norm
+        work = np.float32 if block.dtype.itemsize <= 2 else np.float64
+        out = block.astype(work)
+        out -= lo
+        out *= scale
+        if np.issubdtype(dtype, np.integer):
+            np.rint(out, out=out)
+            np.clip(out, 0, np.iinfo(dtype).max, out=out)
+        else:
+            np.clip(out, 0, 1, out=out)
+        return out.astype(dtype, copy=False)
+
+    @property
+    def load_id(self):
+        """
+        Unique id of the loaded data; changes whenever it is replaced or
+        cleared, and when centring replaces the frames everything reads.
+        """
+        return self._load_id
+
+    def needs_centring(self):
+        return self.centred_data is None and not self._centring
+
+    def is_centring(self):
+        return self._centring
 
-        self.mean_img = self.dp.mean().data
+    def center_direct_beam(self, progress_callback=None):
+        """
+        Centre every frame on the direct beam, one chunk of scan rows at a
+        time. The same pass accumulates the centred mean/max DP and the
+        CubeStatistics of the cube, so a new dataset is read only once.
+        Shifts that are already known (ingest cache) are applied without
+        fitting the beam again, so a reopened dataset shows the same centred
+        frames as a fresh load.
+
+        ``progress_callback(done_rows, total_rows)`` is called after each
+        chunk. Returns False if a new file was loaded in the meantime.
+        """
+        load_id = self._load_id
+        self._centring = True
+        shape = self.get_shape()
+        known_shifts = self.shifts
+        shifts = np.zeros(shape[:2] + (2,), dtype=np.float64)
+        total = np.zeros(shape[2:], dtype=np.float64)
+        max_img = None
+        centred = None
+        stats = CubeStatistics(shape) if self.stats is None else self.stats
+        for y0, y1, block in self.iter_row_blocks(raw=True):
+            if stats is not self.stats:
+                stats.update(y0, y1, block)
+            sig = hs.signals.Signal2D(block)
+            sig.set_signal_type("electron_diffraction")
+            if known_shifts is None:
+                block_shifts = sig.get_direct_beam_position(
+                    method="blur", half_square_width=50, sigma=1.5
+                )
+                shifts[y0:y1] = block_shifts.data
+            else:
+                shifts[y0:y1] = known_shifts[y0:y1]
+                block_shifts = hs.signals.Signal1D(shifts[y0:y1])
+            sig.center_direct_beam(shifts=block_shifts)
+            if centred is None:
+                centred, self._centred_path = self._allocate(shape, sig.data.dtype)
+            centred[y0:y1] = sig.data
+            total += sig.data.sum(axis=(0, 1), dtype=np.float64)
+            block_max = sig.data.max(axis=(0, 1))
+            if max_img is None:
+                max_img = block_max
+            else:
+                np.maximum(max_img, block_max, out=max_img)
+            if self._load_id != load_id:
+                return False
+            if progress_callback is not None:
+                progress_callback(y1, shape[0])
+                if self._load_id != load_id:
+                    return False
+
+        if self.lazy:
+            data = da.from_array(
+                centred, chunks=(self.get_chunk_rows(), -1, -1, -1)
+            )
+            dp = hs.signals.LazySignal2D(data)
+        else:
+            dp = hs.signals.Signal2D(centred)
+        dp.set_signal_type("electron_diffraction")
+        dp.calibration.center = None
+
+        self.shifts = shifts
+        self.mean_img = total / (shape[0] * shape[1])
+        self.max_img = max_img
+        self.stats = stats
+        self.centred_data = centred
+        # Everything derived from the raw frames is stale now
+        self._load_id = next(_load_ids)
+        self._reset_binned()
+        self.pyramid = None
+        self._dp = dp
+        self._centring = False
+        self._store_cache()
+        return True
+
+    def _allocate(self, shape, dtype):
+        """
+        ``(array, path)`` for a cube derived from this one. Derived cubes of a
+        lazily opened cube are kept on disk as well, in a spill file at
+        ``path`` (see SpillFiles); otherwise ``path`` is None.
+        """
+        if not self.lazy:
+            return np.empty(shape, dtype=dtype), None
+        return Spill_Files.allocate(shape, dtype)
+
+    def _reset_binned(self):
+        # Views elsewhere (prefetcher, handlers) may still hold the binned
+        # processors; clear them too so their memory maps are closed
+        for binned in self._binned.values():
+            binned.clear()
+        self._binned = {}
+        Spill_Files.remove(self._binned_paths)
+        self._binned_paths = []
+
+    def _build_signal(self):
+        # Fits the direct beam, or applies the shifts of the ingest cache
+        self.center_direct_beam()
+
+    def _store_cache(self):
+        if self._cache_options is not None:
+            file_path, options = self._cache_options
+            Ingest_Cache.store(file_path, self, **options)
+            self._cache_options = None
+
+    @property
+    def dp(self):
+        if self._dp is None:
+            self._build_signal()
+        return self._dp
+
+    def source(self):
+        """
+        The cube every view and reduction reads: the centred cube once
+        centring has finished, the raw cube until then. Masks drawn on a
+        displayed pattern therefore select the same pixels in reductions.
+        """
+        return self.raw_data if self.centred_data is None else self.centred_data
+
+    def _read(self, index, source=None):
+        """``source[index]`` in memory; raw frames are normalized on read."""
+        source = self.source() if source is None else source
+        block = np.asarray(source[index])
+        if source is self.raw_data:
+            return self._apply_norm(block)
+        return block
 
     def get_img(self, img_index):
         y = img_index // self.x_range
         x = img_index % self.x_range
-        return self.raw_data[y, x]
+        return self._read((y, x))
 
     def get_mean_img(self):
+        if self.mean_img is None:
+            self._build_signal()
         return self.mean_img
 
+    def get_max_img(self):
+        if self.max_img is None:
+            self._build_signal()
+        return self.max_img
+
+    def get_statistics(self):
+        """Summary statistics of the cube, shared by all namespaces."""
+        if self.stats is None:
+            self.stats = compute_statistics(self)
+        return self.stats
+
+    def memory_usage(self):
+        """Bytes of dataset state held in RAM (memory maps are not counted)."""
+        arrays = [self.raw_data, self.centred_data, self.mean_img, self.max_img]
+        if self.stats is not None:
+            arrays.extend(self.stats.as_dict().values())
+        if self.pyramid is not None:
+            arrays.extend(self.pyramid.levels)
+        arrays.extend(binned.raw_data for binned in self._binned.values())
+        return sum(
+            a.nbytes
+            for a in arrays
+            if isinstance(a, np.ndarray) and not isinstance(a, np.memmap)
+        )
+
     def get_shape(self):
         return self.raw_data.shape
 
+    def get_chunk_rows(self, chunk_bytes=CHUNK_BYTES):
+        return rows_per_chunk(
+            self.raw_data.shape, self.raw_data.dtype.itemsize, chunk_bytes
+        )
+
+    def get_rows(self, y0, y1, raw=False):
+        """
+        Scan rows ``y0:y1`` of ``source()`` as an in-memory array, or of the
+        uncentred cube with ``raw``.
+        """
+        return self._read(np.s_[y0:y1], self.raw_data if raw else None)
+
+    def get_frames(self, y0, y1, x0, x1):
+        """Frames of scan rows ``y0:y1``, columns ``x0:x1`` as an in-memory array."""
+        return self._read(np.s_[y0:y1, x0:x1])
+
+    def iter_row_blocks(self, chunk_rows=None, raw=False):
+        """Yield ``(y0, y1, block)`` with ``block = get_rows(y0, y1, raw)``."""
+        if chunk_rows is None:
+            chunk_rows = self.get_chunk_rows()
+        for y0 in range(0, self.y_range, chunk_rows):
+            y1 = min(y0 + chunk_rows, self.y_range)
+            yield y0, y1, self.get_rows(y0, y1, raw)
+
+    def get_binned(self, factor):
+        """
+        Copy of the cube binned by ``factor`` on the detector, as a
+        DM4Processor. It is built on first use from ``source()``, one scan
+        row at a time, and kept until that changes; the copy of a lazily
+        opened cube is a memory map like the cube.
+        """
+        if factor == 1:
+            return self
+        if factor not in self._binned:
+            shape = self.get_shape()
+            binned, path = self._allocate(
+                shape[:2] + (shape[2] // factor, shape[3] // factor), np.float32
+            )
+            if path is not None:
+                self._binned_paths.append(path)
+            source = self.source()
+
+            def bin_rows(rows):
+                y0, y1 = rows
+                binned[y0:y1] = bin_detector(self._read(np.s_[y0:y1], source), factor)
+
+            Chunked_Reducer.map_row_ranges(self, bin_rows)
+            # Centring may have finished meanwhile; don't keep a stale copy
+            if source is not self.source():
+                return DM4Processor.from_array(binned)
+            self._binned[factor] = DM4Processor.from_array(binned)
+        return self._binned[factor]
+
+    def wants_draft(self):
+        """
+        Whether full reductions are slow enough to show a draft on
+        ``get_draft()`` first, once the draft cube has been built.
+        """
+        return (
+            min(self.get_shape()[2:]) >= DRAFT_BINNING
+            and self.raw_data.nbytes >= PROGRESSIVE_BYTES
+        )
+
+    def has_binned(self, factor):
+        """Whether ``get_binned(factor)`` returns without a pass over the cube."""
+        return factor == 1 or factor in self._binned
+
+    def get_preview(self, display_size=256):
+        """
+        The coarsest binned cube whose frames are still at least
+        ``display_size`` pixels, or the cube itself if none is. Until that
+        cube has been built (``get_binned``), a BinnedFrames view of it.
+        """
+        detector_size = min(self.get_shape()[2:])
+        for factor in PREVIEW_BINNING:
+            if detector_size // factor >= display_size:
+                if self.has_binned(factor):
+                    return self._binned[factor]
+                if factor not in self._frame_views:
+                    self._frame_views[factor] = BinnedFrames(self, factor)
+                return self._frame_views[factor]
+        return self
+
+    def draft_factor(self):
+        """Detector binning of the draft cube; 1 if the detector is too small."""
+        return DRAFT_BINNING if min(self.get_shape()[2:]) >= DRAFT_BINNING else 1
+
+    def get_draft(self):
+        """
+        Binned cube for draft reductions while a selection is being edited,
+        or None until ``get_binned(draft_factor())`` has been built.
+        """
+        factor = self.draft_factor()
+        return self.get_binned(factor) if self.has_binned(factor) else None
+
+    def get_masked_mean(self, bin_mask):
+        """
+        Mean diffraction pattern of the scan positions selected by ``bin_mask``.
+        Only the frames inside the mask are read, one scan row per task.
+        """
+
+        source = self.source()
+
+        def row_sum(y):
+            cols = np.flatnonzero(bin_mask[y])
+            x0, x1 = cols[0], cols[-1] + 1
+            frames = self._read(np.s_[y, x0:x1], source)[bin_mask[y, x0:x1]]
+            return frames.sum(axis=0, dtype=np.float64), len(frames)
+
+        rows = np.flatnonzero(bin_mask.any(axis=1))
+        partials = Chunked_Reducer.map(
+            row_sum, rows, Chunked_Reducer.rows_bytes(self, 1)
+        )
+        total = np.zeros(self.raw_data.shape[2:], dtype=np.float64)
+        count = 0
+        for row_total, row_count in partials:
+            total += row_total
+            count += row_count
+        return total / count
+
+    def build_pyramid(self, max_level=None, progress_callback=None):
+        """
+        Precompute the BlockSumPyramid used by ``get_rect_mean``. It holds
+        about two thirds of the cube size in float32, so it is opt-in.
+        Returns False if a new file was loaded in the meantime.
+        """
+        load_id = self._load_id
+        pyramid = BlockSumPyramid(self, max_level).build(progress_callback)
+        if self._load_id != load_id:
+            return False
+        self.pyramid = pyramid
+        return True
+
+    def get_rect_mean(self, y, x, h, w):
+        """
+        Mean diffraction pattern of the rectangle of scan positions starting
+        at row ``y``, column ``x`` with size ``h`` x ``w``. Uses the block-sum
+        pyramid when it has been built. Only the part inside the scan counts;
+        a rectangle entirely outside it has a zero mean.
+        """
+        y0, y1, x0, x1 = self._clip_rect(y, x, h, w)
+        if y0 >= y1 or x0 >= x1:
+            return np.zeros(self.raw_data.shape[2:], dtype=np.float64)
+        if self.pyramid is not None:
+            return self.pyramid.rect_mean(y0, y1, x0, x1)
+        bin_mask = np.zeros(self.raw_data.shape[:2], dtype=bool)
+        bin_mask[y0:y1, x0:x1] = True
+        return self.get_masked_mean(bin_mask)
+
+    def _clip_rect(self, y, x, h, w):
+        """
+        ``(y0, y1, x0, x1)`` of a rectangle clipped to the scan. Rectangles
+        drawn up or to the left have negative sizes and are flipped.
+        """
+        if h < 0:
+            y, h = y + h, -h
+        if w < 0:
+            x, w = x + w, -w
+        ny, nx = self.raw_data.shape[:2]
+        return max(y, 0), min(y + h, ny), max(x, 0), min(x + w, nx)
 
-DM4_Processor = DM4Processor()
+    def get_rect_draft(self, y, x, h, w, max_frames=DRAFT_FRAMES):
+        """
+        Draft of ``get_rect_mean``: the mean of about ``max_frames`` scan
+        positions of the rectangle on a regular lattice, or None when the
+        exact mean is about as cheap (small rectangle, pyramid built).
+        """
+        y0, y1, x0, x1 = self._clip_rect(y, x, h, w)
+        count = max(y1 - y0, 0) * max(x1 - x0, 0)
+        if self.pyramid is not None or count <= max_frames:
+            return None
+        step = int(np.ceil(np.sqrt(count / max_frames)))
+        frames = self._read(np.s_[y0:y1:step, x0:x1:step])
+        return frames.mean(axis=(0, 1), dtype=np.float64)
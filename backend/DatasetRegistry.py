@@ -0,0 +1,140 @@
+import os
+from collections import OrderedDict
+
+from DM4Processor import DM4Processor
+
+# Bytes of in-memory dataset state kept before cold datasets are evicted
+DEFAULT_MEMORY_BUDGET = int(
+    os.environ.get("PYGLASS_MEMORY_BUDGET", 8 * 1024**3)
+)
+
+
+class DatasetRegistry:
+    """
+    Open datasets keyed by dataset id, with LRU eviction under a memory budget.
+
+    Evicted datasets release their cube and derived products but stay
+    registered; the next ``get`` reloads them (through the ingest cache).
+    Requests without a dataset id target the active dataset, which is the
+    one loaded or selected last.
+    """
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.active_id = None
+        # dataset_id -> DM4Processor, least recently used first
+        self._datasets = OrderedDict()
+        # dataset_id -> (file_path, load_file kwargs)
+        self._sources = {}
+        self._evicted = set()
+        self._evict_callbacks = []
+
+    def __contains__(self, dataset_id):
+        return dataset_id in self._datasets
+
+    def load(self, file_path, dataset_id=None, **kwargs):
+        """
+        Load ``file_path`` as ``dataset_id`` and select it. Loading the same
+        source with the same options again only selects the existing entry,
+        so clients that hold it keep working.
+        """
+        if dataset_id is None:
+            dataset_id = os.path.abspath(file_path)
+        if self._sources.get(dataset_id) == (file_path, kwargs):
+            self.select(dataset_id)
+            return dataset_id
+        if dataset_id in self._datasets:
+            self._datasets[dataset_id].clear()
+        processor = DM4Processor()
+        processor.load_file(file_path, **kwargs)
+        self._datasets[dataset_id] = processor
+        self._sources[dataset_id] = (file_path, kwargs)
+        self._evicted.discard(dataset_id)
+        self.select(dataset_id)
+        return dataset_id
+
+    def select(self, dataset_id):
+        if dataset_id not in self._datasets:
+            raise KeyError(f"Unknown dataset: {dataset_id}")
+        self.active_id = dataset_id
+        self._touch(dataset_id)
+
+    def get(self, dataset_id=None):
+        if dataset_id is None:
+            dataset_id = self.active_id
+        if dataset_id not in self._datasets:
+            raise KeyError(f"Unknown dataset: {dataset_id}")
+        if dataset_id in self._evicted:
+            file_path, kwargs = self._sources[dataset_id]
+            self._datasets[dataset_id].load_file(file_path, **kwargs)
+            self._evicted.discard(dataset_id)
+        self._touch(dataset_id)
+        return self._datasets[dataset_id]
+
+    def remove(self, dataset_id):
+        processor = self._datasets.pop(dataset_id)
+        processor.clear()
+        self._sources.pop(dataset_id)
+        self._evicted.discard(dataset_id)
+        if self.active_id == dataset_id:
+            self.active_id = next(reversed(self._datasets), None)
+        self._notify_evicted(dataset_id)
+
+    def close(self):
+        """
+        Release the data of every dataset, e.g. before exit, closing their
+        memory maps. They stay registered and reload on the next ``get``.
+        """
+        for processor in self._datasets.values():
+            processor.clear()
+        self._evicted.update(self._datasets)
+
+    def list(self):
+        return [
+            {
+                "dataset_id": dataset_id,
+                "file_path": self._sources[dataset_id][0],
+                "loaded": dataset_id not in self._evicted,
+                "nbytes": processor.memory_usage(),
+                "active": dataset_id == self.active_id,
+            }
+            for dataset_id, processor in self._datasets.items()
+        ]
+
+    def memory_usage(self):
+        return sum(p.memory_usage() for p in self._datasets.values())
+
+    def set_memory_budget(self, memory_budget):
+        self.memory_budget = memory_budget
+        self._evict(keep=self.active_id)
+
+    def on_evict(self, callback):
+        """
+        Register ``callback(dataset_id)``, called when a dataset is evicted
+        or removed.
+        """
+        self._evict_callbacks.append(callback)
+
+    def _touch(self, dataset_id):
+        self._datasets.move_to_end(dataset_id)
+        self._evict(keep=dataset_id)
+
+    def _evict(self, keep):
+        for dataset_id in list(self._datasets):
+            if self.memory_usage() <= self.memory_budget:
+                break
+            if dataset_id == keep or dataset_id in self._evicted:
+                continue
+            processor = self._datasets[dataset_id]
+            if processor.is_centring():
+                continue
+            processor.clear()
+            self._evicted.add(dataset_id)
+            self._notify_evicted(dataset_id)
+
+    def _notify_evicted(self, dataset_id):
+        for callback in self._evict_callbacks:
+            callback(dataset_id)
+
+
+Dataset_Registry = DatasetRegistry()
@@ -0,0 +1,78 @@
+import functools
+from collections import deque
+
+from flask import request
+
+
+class _Pending:
+    def __init__(self, key, ready):
+        self.key = key
+        self.ready = ready
+        self.stale = False
+
+
+class LatestWins:
+    """
+    Per-client, latest-wins scheduling of Socket.IO event handlers.
+
+    The decorated handlers of one client share a FIFO queue and run one at
+    a time, in arrival order. A queued event is dropped when a newer event
+    with the same coalescing key (namespace, handler and optional key of
+    the payload) arrives behind it. A burst of slider events therefore
+    renders only the latest state, and events of different kinds, e.g. a
+    parameter update followed by an image request, keep their order.
+    """
+
+    def __init__(self, sleep, create_event):
+        # Async-mode primitives of the server, e.g. socketio.sleep
+        self._sleep = sleep
+        self._create_event = create_event
+        self._queues = {}
+
+    def __call__(self, key=None):
+        """
+        Decorator for a handler ``fn(namespace, data)``. ``key(data)``
+        separates events of one handler that must not replace each other,
+        e.g. parameter updates for the left and the right image.
+        """
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(namespace, *args):
+                data = args[0] if args else None
+                item = _Pending(
+                    (namespace.namespace, fn.__name__, key(data) if key else None),
+                    self._create_event(),
+                )
+                sid = request.sid
+                queue = self._queues.setdefault(sid, deque())
+                for pending in queue:
+                    if pending.key == item.key:
+                        pending.stale = True
+                queue.append(item)
+                if len(queue) > 1:
+                    item.ready.wait()
+                # Let events that were already received join the queue first
+                self._sleep(0)
+                try:
+                    if not item.stale:
+                        return fn(namespace, *args)
+                finally:
+                    queue.popleft()
+                    if queue:
+                        queue[0].ready.set()
+                    else:
+                        self._queues.pop(sid, None)
+
+            return wrapper
+
+        return decorator
+
+    def superseded(self):
+        """
+        Whether a newer event of the kind being handled is already queued,
+        e.g. to skip the full-quality pass after a preview. Call from inside
+        a decorated handler.
+        """
+        queue = self._queues.get(request.sid)
+        return bool(queue) and queue[0].stale
@@ -0,0 +1,76 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Total size of the encoded frames kept before the least recently used go
+DEFAULT_MAX_BYTES = int(os.environ.get("PYGLASS_FRAME_CACHE_BYTES", 256 * 1024**2))
+
+
+def frame_key(dataset, index, params, transport_key, histogram=None):
+    """
+    Cache key of one displayed frame: the dataset's load id, the frame index,
+    the display parameters (``ImageProcessor.get_params()``), the transport's
+    codec settings and whether auto-contrast used the cube-wide ``histogram``
+    of the dataset rather than the frame's own.
+    """
+    return (
+        (dataset.load_id, index)
+        + tuple(params)
+        + (transport_key, histogram is not None)
+    )
+
+
+class FrameCache:
+    """
+    LRU cache of encoded frames, bounded by the total size of the encodings.
+
+    Display parameters and codec are part of the key, so changing them
+    simply misses; entries for other parameters stay valid and are reused
+    when the user goes back. Entries of a dataset whose frames changed
+    (e.g. after centring) are dropped with ``invalidate``. The cache is
+    shared with the prefetch worker thread, so access is locked.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key, compute):
+        """Return the cached encoding for ``key``, calling ``compute()`` on a miss."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= len(self._entries.pop(key))
+            self._entries[key] = value
+            self.nbytes += len(value)
+            while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def invalidate(self, load_id):
+        """Drop the frames of the dataset with ``load_id``."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == load_id]:
+                self.nbytes -= len(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+Frame_Cache = FrameCache()
@@ -0,0 +1,109 @@
+import copy
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from FrameCache import Frame_Cache, frame_key
+from ImageProcessor import ImageProcessor
+
+# Frames read ahead in the scrub direction
+DEFAULT_DEPTH = int(os.environ.get("PYGLASS_PREFETCH_DEPTH", 4))
+# Encoded bytes one prefetch round may add to the frame cache
+DEFAULT_MAX_BYTES = int(os.environ.get("PYGLASS_PREFETCH_BYTES", 32 * 1024**2))
+
+
+class FramePrefetcher:
+    """
+    Reads, adjusts and encodes the frames a scrubbing user is likely to ask
+    for next into the frame cache, on a background worker thread.
+
+    Each observed ``set_index`` gives the scrub step; the next ``depth``
+    frames along that step and the frames in the neighbouring scan rows are
+    prefetched. A newer observation abandons the round still running.
+    """
+
+    def __init__(
+        self, frame_cache=Frame_Cache, depth=DEFAULT_DEPTH, max_bytes=DEFAULT_MAX_BYTES
+    ):
+        self.frame_cache = frame_cache
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self._last = None
+        self._step = 1
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="pyglass-prefetch"
+        )
+
+    def configure(self, depth=None, max_bytes=None):
+        if depth is not None:
+            self.depth = max(0, int(depth))
+        if max_bytes is not None:
+            self.max_bytes = max(0, int(max_bytes))
+        return {"depth": self.depth, "max_bytes": self.max_bytes}
+
+    def cancel(self):
+        """Abandon the running round, e.g. when its dataset is evicted."""
+        with self._lock:
+            self._last = None
+            self._generation += 1
+
+    def predict(self, dataset, index):
+        """Frame indices to prefetch after a request for ``index``, nearest first."""
+        shape = dataset.get_shape()
+        n_frames = shape[0] * shape[1]
+        row = shape[1]
+        candidates = [index + k * self._step for k in range(1, self.depth + 1)]
+        candidates += [index + row, index - row, index - self._step]
+        seen = {index}
+        frames = []
+        for i in candidates:
+            if 0 <= i < n_frames and i not in seen:
+                seen.add(i)
+                frames.append(i)
+        return frames
+
+    def observe(self, dataset, index, params, transport, histogram=None):
+        """
+        Record a request for frame ``index`` and prefetch around it.
+        ``histogram`` is the cube-wide histogram used for auto-contrast, if any.
+        """
+        with self._lock:
+            if self._last is not None and self._last[0] is dataset:
+                step = index - self._last[1]
+                if step != 0:
+                    self._step = step
+            self._last = (dataset, index)
+            self._generation += 1
+            generation = self._generation
+        if self.depth == 0 or self.max_bytes == 0:
+            return
+        frames = self.predict(dataset, index)
+        # Snapshot the settings, the caller's objects keep changing
+        transport = copy.copy(transport)
+        params = tuple(params)
+        self._executor.submit(
+            self._prefetch, generation, dataset, frames, params, transport, histogram
+        )
+
+    def _prefetch(self, generation, dataset, frames, params, transport, histogram):
+        processor = ImageProcessor()
+        processor.updata_params(*params)
+        # Frames change when the dataset is reloaded or its centring finishes
+        source = (dataset.load_id, dataset.centred_data is not None)
+        added = 0
+        for index in frames:
+            if generation != self._generation or added >= self.max_bytes:
+                return
+            if dataset.load_id != source[0]:
+                return
+            key = frame_key(dataset, index, params, transport.key, histogram)
+            if key in self.frame_cache:
+                continue
+            processor.load_img(dataset.get_img(index), histogram)
+            data = transport.encode(processor.get_img())
+            if (dataset.load_id, dataset.centred_data is not None) != source:
+                return
+            self.frame_cache.put(key, data)
+            added += len(data)
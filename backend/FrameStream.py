@@ -0,0 +1,77 @@
+import zlib
+
+import numpy as np
+
+from ImageCodec import to_uint8
+
+# A full frame is sent at least this often, so a client can resync
+KEYFRAME_INTERVAL = 30
+# zlib level of the frame payloads; deltas of neighbouring DPs are mostly zero
+COMPRESSION_LEVEL = 1
+
+
+def stream_indices(spec, scan_shape):
+    """
+    Frame indices of a playback range: ``{"row": y}`` for a scan row,
+    ``{"path": [[y, x], ...]}`` for a path of scan positions, or
+    ``{"start", "stop", "step"}`` for a range of frame indices. Raises
+    ValueError for positions outside the scan and for empty ranges.
+    """
+    ny, nx = scan_shape
+    if "row" in spec:
+        y = int(spec["row"])
+        if not 0 <= y < ny:
+            raise ValueError(f"Row {y} out of range 0-{ny - 1}")
+        return list(range(y * nx, (y + 1) * nx))
+    if "path" in spec:
+        indices = []
+        for y, x in spec["path"]:
+            if not (0 <= y < ny and 0 <= x < nx):
+                raise ValueError(f"Scan position ({y}, {x}) out of range")
+            indices.append(int(y) * nx + int(x))
+    else:
+        start = int(spec.get("start", 0))
+        if start < 0:
+            raise ValueError(f"Start {start} is negative")
+        stop = min(int(spec.get("stop", ny * nx)), ny * nx)
+        indices = list(range(start, stop, int(spec.get("step", 1))))
+    if not indices:
+        raise ValueError("Nothing to play")
+    return indices
+
+
+class DeltaEncoder:
+    """
+    Inter-frame compression for a stream of display frames.
+
+    Keyframes are the zlib-compressed uint8 pixels. Other frames are the
+    byte-wise difference to the previous frame (mod 256), compressed the same
+    way; a client adds them to its last frame. Consecutive diffraction
+    patterns along a scan differ little, so deltas compress far better than
+    independent PNGs.
+    """
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL, level=COMPRESSION_LEVEL):
+        self.keyframe_interval = keyframe_interval
+        self.level = level
+        self._previous = None
+        self._since_keyframe = 0
+
+    def encode(self, img):
+        """Return ``(kind, shape, payload)`` for a float 0-1 or uint8 frame."""
+        frame = to_uint8(img)
+        keyframe = (
+            self._previous is None
+            or self._previous.shape != frame.shape
+            or self._since_keyframe >= self.keyframe_interval
+        )
+        if keyframe:
+            data = frame
+            self._since_keyframe = 0
+        else:
+            # uint8 arithmetic wraps, which the client undoes with the same wrap
+            data = frame - self._previous
+            self._since_keyframe += 1
+        self._previous = frame
+        payload = zlib.compress(np.ascontiguousarray(data).tobytes(), self.level)
+        return ("key" if keyframe else "delta"), list(frame.shape), payload
@@ -0,0 +1,114 @@
+import numpy as np
+
+# Upper bound on the number of bins of a Histogram. Fine enough that a hot
+# pixel 1000x the background still leaves the background ~65 bins, and 16-bit
+# detector counts get one bin per value.
+HIST_BINS = 2**16
+
+
+def grid_width(lo, hi, max_bins=HIST_BINS):
+    """Smallest power-of-two bin width that covers [lo, hi] in ``max_bins`` bins."""
+    span = hi - lo
+    if not span > 0:
+        return 1.0
+    width = 2.0 ** np.ceil(np.log2(span / max_bins))
+    while np.floor(hi / width) - np.floor(lo / width) + 1 > max_bins:
+        width *= 2
+    return width
+
+
+class Histogram:
+    """
+    Intensity histogram on a power-of-two grid.
+
+    Bins are ``width`` wide with ``width`` a power of two and ``lo`` a
+    multiple of it, so histograms of different blocks of data can be merged
+    exactly by summing pairs of bins, which lets the cube-wide histogram be
+    built in a streaming pass without knowing the value range beforehand.
+    Percentiles and equalization read the cumulative counts instead of
+    sorting the data.
+    """
+
+    def __init__(self, lo=0.0, width=1.0, counts=None, max_bins=HIST_BINS):
+        self.lo = float(lo)
+        self.width = float(width)
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else counts
+        self.max_bins = max_bins
+
+    @classmethod
+    def of(cls, data, max_bins=HIST_BINS):
+        data = np.asarray(data)
+        if data.size == 0:
+            return cls(max_bins=max_bins)
+        dmin, dmax = float(data.min()), float(data.max())
+        width = grid_width(dmin, dmax, max_bins)
+        lo = np.floor(dmin / width) * width
+        n = int(np.floor(dmax / width) - lo / width) + 1
+        work = np.float32 if data.dtype.itemsize <= 2 else np.float64
+        index = np.subtract(data, lo, dtype=work)
+        index /= width
+        index = index.astype(np.intp).ravel()
+        # Rounding can put the maximum one bin too far
+        np.minimum(index, n - 1, out=index)
+        return cls(lo, width, np.bincount(index, minlength=n), max_bins)
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    @property
+    def edges(self):
+        return self.lo + self.width * np.arange(len(self.counts) + 1)
+
+    def coarsen(self, width):
+        """The histogram rebinned to ``width``, a power-of-two multiple."""
+        if width <= self.width or len(self.counts) == 0:
+            return self
+        ratio = int(round(width / self.width))
+        lo = np.floor(self.lo / width) * width
+        offset = int(round((self.lo - lo) / self.width))
+        n = -(-(offset + len(self.counts)) // ratio) * ratio
+        padded = np.zeros(n, dtype=np.int64)
+        padded[offset : offset + len(self.counts)] = self.counts
+        counts = padded.reshape(-1, ratio).sum(axis=1)
+        return Histogram(lo, width, counts, self.max_bins)
+
+    def merge(self, other):
+        """Histogram of the data of both histograms."""
+        if len(other.counts) == 0:
+            return self
+        if len(self.counts) == 0:
+            return other
+        width = max(self.width, other.width)
+        while True:
+            a, b = self.coarsen(width), other.coarsen(width)
+            lo = min(a.lo, b.lo)
+            starts = [int(round((h.lo - lo) / width)) for h in (a, b)]
+            n = max(s + len(h.counts) for s, h in zip(starts, (a, b)))
+            if n <= self.max_bins:
+                break
+            width *= 2
+        counts = np.zeros(n, dtype=np.int64)
+        for start, h in zip(starts, (a, b)):
+            counts[start : start + len(h.counts)] += h.counts
+        return Histogram(lo, width, counts, self.max_bins)
+
+    def cdf(self):
+        """Cumulative fraction of the data at each bin edge."""
+        cumulative = np.concatenate(([0], np.cumsum(self.counts)))
+        return cumulative / max(cumulative[-1], 1)
+
+    def percentiles(self, q):
+        """Values below which ``q`` percent of the data lies, interpolated in bins."""
+        return np.interp(np.asarray(q, dtype=np.float64) / 100, self.cdf(), self.edges)
+
+    def equalize(self, data):
+        """Map ``data`` to its cumulative frequency, 0-1 as float32."""
+        return np.interp(data, self.edges, self.cdf()).astype(np.float32)
+
+    def as_arrays(self):
+        return np.array([self.lo, self.width]), self.counts
+
+    @classmethod
+    def from_arrays(cls, grid, counts):
+        return cls(grid[0], grid[1], np.asarray(counts, dtype=np.int64))
@@ -0,0 +1,118 @@
+import base64
+
+import cv2
+import numpy as np
+
+# Codecs an ImageTransport can negotiate, with the MIME type clients decode with
+CODECS = {
+    "raw": "application/octet-stream",
+    "png": "image/png",
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+}
+# zlib level 1 is several times faster than the higher levels and barely
+# larger on diffraction patterns; PNG stays lossless either way
+DEFAULT_PNG_LEVEL = 1
+DEFAULT_QUALITY = 85
+# JPEG quality of the quick previews sent ahead of full-quality images
+PREVIEW_QUALITY = 60
+
+
+def to_uint8(img):
+    """Convert a float image in the range 0-1 to uint8."""
+    if img.dtype == np.uint8:
+        return img
+    return (img * 255).astype(np.uint8)
+
+
+def encode_raw(img):
+    """
+    Uncompressed uint8 pixels behind an 8-byte header of little-endian
+    uint16 (height, width, channels, 0). Colour images are in BGR order.
+    """
+    channels = 1 if img.ndim == 2 else img.shape[2]
+    header = np.array([img.shape[0], img.shape[1], channels, 0], dtype="<u2")
+    return header.tobytes() + np.ascontiguousarray(img).tobytes()
+
+
+def encode_image(
+    img, codec="png", png_level=DEFAULT_PNG_LEVEL, quality=DEFAULT_QUALITY
+):
+    """Encode a float 0-1 (or uint8) grayscale or BGR image to bytes."""
+    img = to_uint8(img)
+    if codec == "raw":
+        return encode_raw(img)
+    if codec == "png":
+        params = [cv2.IMWRITE_PNG_COMPRESSION, png_level]
+    elif codec == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    elif codec == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    else:
+        raise ValueError(f"Unknown codec: {codec}")
+    _, buffer = cv2.imencode("." + codec, img, params)
+    return buffer.tobytes()
+
+
+class ImageTransport:
+    """
+    How one namespace sends images: the codec, and whether the bytes go out
+    as binary Socket.IO attachments or base64 strings inside the JSON.
+
+    The default is base64 PNG, which is what clients that never negotiate
+    expect. Raw pixels are only offered over binary transport.
+    """
+
+    def __init__(
+        self,
+        binary=False,
+        codec="png",
+        png_level=DEFAULT_PNG_LEVEL,
+        quality=DEFAULT_QUALITY,
+    ):
+        self.binary = binary
+        self.codec = codec
+        self.png_level = png_level
+        self.quality = quality
+
+    def configure(self, binary=None, codec=None, png_level=None, quality=None):
+        """Apply the settings a client asked for and return the accepted ones."""
+        if binary is not None:
+            self.binary = bool(binary)
+        if codec is not None:
+            if codec not in CODECS:
+                raise ValueError(f"Unknown codec: {codec}")
+            self.codec = codec
+        if self.codec == "raw" and not self.binary:
+            self.codec = "png"
+        if png_level is not None:
+            self.png_level = int(np.clip(png_level, 0, 9))
+        if quality is not None:
+            self.quality = int(np.clip(quality, 1, 100))
+        return self.describe()
+
+    def describe(self):
+        return {
+            "binary": self.binary,
+            "codec": self.codec,
+            "mime": CODECS[self.codec],
+            "png_level": self.png_level,
+            "quality": self.quality,
+        }
+
+    @property
+    def key(self):
+        """Identifies the encoded output, for caches of encoded images."""
+        level = self.png_level if self.codec == "png" else self.quality
+        return (self.binary, self.codec, level)
+
+    def preview(self):
+        """Transport for quick low-quality previews, over the same channel."""
+        return ImageTransport(self.binary, "jpeg", quality=PREVIEW_QUALITY)
+
+    def encode(self, img):
+        """Encoded image as bytes (binary transport) or a base64 string."""
+        data = encode_image(img, self.codec, self.png_level, self.quality)
+        if self.binary:
+            return data
+        return base64.b64encode(data).decode("utf-8")
@@ -1,5 +1,12 @@
 import numpy as np
 
+from Histogram import Histogram
+
+# Auto-contrast modes: min/max scaling, percentile clip, histogram equalization
+AUTO_CONTRAST_MODES = (None, "percentile", "equalize")
+# Percentiles kept by the "percentile" mode
+DEFAULT_CLIP = (0.5, 99.5)
+
 
 def normalize(data, log_scale=False):
     if log_scale:
@@ -8,7 +15,115 @@ def normalize(data, log_scale=False):
     return normalized_data
 
 
+def auto_normalize(data, histogram, mode, clip=DEFAULT_CLIP, log_scale=False):
+    """
+    Scale ``data`` to 0-1 from a histogram of its values instead of its min
+    and max: "percentile" clips to the ``clip`` percentiles, so hot pixels
+    and the direct beam do not wash out the rest, and "equalize" maps each
+    value to its cumulative frequency. ``histogram`` may be of other data,
+    e.g. the whole cube, for a contrast shared by all frames.
+    """
+    if mode == "equalize":
+        # Equalization is unchanged by the (monotonic) log scaling
+        return histogram.equalize(data)
+    lo, hi = histogram.percentiles(clip)
+    data = np.asarray(data, dtype=np.float64)
+    if log_scale:
+        offset = min(data.min(), lo) - 1
+        data = np.log(data - offset)
+        lo, hi = np.log(lo - offset), np.log(hi - offset)
+    if not hi > lo:
+        return np.zeros(data.shape, dtype=np.float32)
+    scaled = ((data - lo) / (hi - lo)).astype(np.float32)
+    return np.clip(scaled, 0, 1, out=scaled)
+
+
+def gamma_table(gamma):
+    """uint8 -> uint8 gamma correction table."""
+    levels = np.arange(256) / 255.0
+    return ((levels ** (1.0 / gamma)) * 255).astype("uint8")
+
+
+def adjust_table(gamma, contrast, brightness):
+    """Gamma, contrast and brightness as one uint8 -> float32 table."""
+    levels = gamma_table(gamma) / 255.0
+    return np.clip(contrast * levels + brightness, 0, 1).astype(np.float32)
+
+
+def adjust_stack(stack, params):
+    """
+    Run the display pipeline on an (N, H, W) stack in one batched pass.
+
+    ``params`` is one ``ImageProcessor.get_params()`` tuple shared by all
+    frames, or a sequence of N such tuples. Every frame is normalized on its
+    own, exactly as ``ImageProcessor.get_img`` would.
+    """
+    stack = np.asarray(stack)
+    n = len(stack)
+    if np.isscalar(params[0]):
+        params = [params] * n
+    # (gamma, contrast, brightness, log_scale) tuples use min/max scaling
+    params = [tuple(p) + (None, DEFAULT_CLIP)[len(p) - 4 :] for p in params]
+    gamma, contrast, brightness, log_scale = (
+        np.array(p) for p in list(zip(*params))[:4]
+    )
+    log_scale = log_scale.astype(bool)
+    auto = np.array([p[4] is not None for p in params], dtype=bool)
+
+    data = stack.astype(np.float64)
+    minmax = log_scale & ~auto
+    if minmax.any():
+        logged = data[minmax]
+        lo = logged.min(axis=(1, 2), keepdims=True)
+        data[minmax] = np.log(logged - lo + 1)
+    lo = data.min(axis=(1, 2), keepdims=True)
+    hi = data.max(axis=(1, 2), keepdims=True)
+    normalized = ((data - lo) / (hi - lo)).astype(np.float32)
+    # Auto-contrast needs a histogram per frame
+    for i in np.flatnonzero(auto):
+        _, _, _, log_i, mode, clip = params[i]
+        normalized[i] = auto_normalize(
+            stack[i], Histogram.of(stack[i]), mode, clip, log_i
+        )
+
+    out = np.empty(normalized.shape, dtype=np.float32)
+    linear = gamma == 1
+    if linear.any():
+        # Same in-place float pass as ImageProcessor.adjust with gamma 1
+        scaled = np.multiply(
+            normalized[linear],
+            contrast[linear, None, None].astype(np.float32),
+            dtype=np.float32,
+        )
+        scaled += brightness[linear, None, None].astype(np.float32)
+        out[linear] = np.clip(scaled, 0, 1, out=scaled)
+    if not linear.all():
+        frames = np.flatnonzero(~linear)
+        tables = np.stack(
+            [adjust_table(gamma[i], contrast[i], brightness[i]) for i in frames]
+        )
+        quantized = (normalized[frames] * 255).astype(np.uint8)
+        out[frames] = tables[np.arange(len(frames))[:, None, None], quantized]
+    return out
+
+
 class ImageProcessor:
+    """
+    Display pipeline: normalize (optionally log) -> gamma -> contrast and
+    brightness.
+
+    Normalization scales the image's min/max to 0-1, or with
+    ``auto_contrast`` clips to percentiles of / equalizes by a histogram of
+    the image (see ``auto_normalize``). The histogram is computed once per
+    loaded image, or passed to ``load_img``, e.g. the cube-wide histogram.
+
+    Each stage is cached and a parameter change only invalidates the stages
+    after it: ``log_scale`` and auto-contrast re-normalize, while gamma,
+    contrast and brightness only rebuild a 256-entry lookup table (gamma and
+    the linear stretch fused) or redo one in-place pass when gamma is 1. The
+    returned image is cached as well and must not be modified by the caller.
+    """
+
     def __init__(self):
         self.raw_img = None
         self.adjusted_img = None
@@ -16,45 +131,112 @@ class ImageProcessor:
         self.contrast = 1
         self.brightness = 0
         self.log_scale = False
+        self.auto_contrast = None
+        self.clip = DEFAULT_CLIP
+        # Stage caches
+        self._histogram = None
+        self._normalized = None
+        self._quantized = None
+        self._lut = None
 
-    def load_img(self, img: np.ndarray):
+    def load_img(self, img: np.ndarray, histogram=None):
         self.raw_img = img
         self.adjusted_img = None
+        self._histogram = histogram
+        self._normalized = None
+        self._quantized = None
 
     def updata_params(
-        self, gamma: float, contrast: float, brightness: float, log_scale=False
+        self,
+        gamma: float,
+        contrast: float,
+        brightness: float,
+        log_scale=False,
+        auto_contrast=None,
+        clip=DEFAULT_CLIP,
     ):
+        if auto_contrast not in AUTO_CONTRAST_MODES:
+            raise ValueError(f"Unknown auto-contrast mode: {auto_contrast}")
+        clip = tuple(clip)
+        if (log_scale, auto_contrast, clip) != (
+            self.log_scale,
+            self.auto_contrast,
+            self.clip,
+        ):
+            self._normalized = None
+            self._quantized = None
+        if (gamma, contrast, brightness) != self.get_params()[:3]:
+            self._lut = None
+        params = (gamma, contrast, brightness, log_scale, auto_contrast, clip)
+        if params != self.get_params():
+            self.adjusted_img = None
         self.gamma = gamma
         self.contrast = contrast
         self.brightness = brightness
         self.log_scale = log_scale
+        self.auto_contrast = auto_contrast
+        self.clip = clip
+
+    def get_params(self):
+        return (
+            self.gamma,
+            self.contrast,
+            self.brightness,
+            self.log_scale,
+            self.auto_contrast,
+            self.clip,
+        )
+
+    def histogram(self):
+        if self._histogram is None:
+            self._histogram = Histogram.of(self.raw_img)
+        return self._histogram
+
+    def normalized(self):
+        if self._normalized is None:
+            if self.auto_contrast is None:
+                normalized = normalize(self.raw_img, log_scale=self.log_scale)
+                self._normalized = normalized.astype(np.float32)
+            else:
+                self._normalized = auto_normalize(
+                    self.raw_img,
+                    self.histogram(),
+                    self.auto_contrast,
+                    self.clip,
+                    self.log_scale,
+                )
+        return self._normalized
+
+    def lut(self):
+        if self._lut is None:
+            self._lut = adjust_table(self.gamma, self.contrast, self.brightness)
+        return self._lut
 
     def adjust(self):
         if self.raw_img is None:
             raise ValueError("No image loaded.")
-        self.adjusted_img = normalize(self.raw_img, log_scale=self.log_scale)
-
-        # Gamma correction
         if self.gamma != 1:
-            inv_gamma = 1.0 / self.gamma
-            table = np.array(
-                [((i / 255.0) ** inv_gamma) * 255 for i in range(256)]
-            ).astype("uint8")
-            image_255 = (self.adjusted_img * 255).astype(np.uint8)
-            self.adjusted_img = table[image_255] / 255.0
-
-        # Contrast and brightness adjustment
-        self.adjusted_img = np.clip(
-            self.contrast * self.adjusted_img + self.brightness, 0, 1
-        )
+            # Gamma works on the 8-bit image, so the whole chain is one lookup
+            if self._quantized is None:
+                self._quantized = (self.normalized() * 255).astype(np.uint8)
+            self.adjusted_img = self.lut()[self._quantized]
+        else:
+            adjusted = np.multiply(self.normalized(), self.contrast, dtype=np.float32)
+            adjusted += self.brightness
+            self.adjusted_img = np.clip(adjusted, 0, 1, out=adjusted)
 
     def get_img(self):
-        self.adjust()
-        return (
-            (self.adjusted_img).astype(np.float32)
-            if self.adjusted_img is not None
-            else (self.raw_img).astype(np.float32)
-        )
+        if self.adjusted_img is None:
+            self.adjust()
+        return self.adjusted_img
+
+    def get_stack(self, stack, params=None):
+        """
+        Adjust an (N, H, W) stack of frames in one pass, with this
+        processor's parameters or with ``params`` (see ``adjust_stack``).
+        The loaded image is not changed.
+        """
+        return adjust_stack(stack, self.get_params() if params is None else params)
 
 
 Image_Processor = ImageProcessor()
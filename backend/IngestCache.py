@@ -0,0 +1,161 @@
+import hashlib
+import os
+
+import h5py
+import numpy as np
+from loguru import logger
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".pyglass", "ingest_cache")
+# Total size of the cache entries kept before the least recently used go
+DEFAULT_MAX_BYTES = int(os.environ.get("PYGLASS_INGEST_CACHE_BYTES", 32 * 1024**3))
+# Derived products stored next to the cube: dataset name -> processor attribute
+DERIVED_KEYS = {"mean_dp": "mean_img", "max_dp": "max_img", "shifts": "shifts"}
+
+
+class IngestCache:
+    """
+    On-disk cache of ingested datasets.
+
+    Each entry is an HDF5 file holding the (normalized) cube, chunked per
+    frame and compressed, together with the derived products and the cube
+    statistics. Entries are keyed by file path, mtime, size and the load
+    options, so a changed source file never hits a stale entry.
+
+    The cache holds at most ``max_bytes``: after each write the least
+    recently opened entries are removed. Writing is best-effort; a failed
+    write (disk full, no permission) leaves no partial file behind.
+    """
+
+    def __init__(
+        self, cache_dir=CACHE_DIR, compression="lzf", max_bytes=DEFAULT_MAX_BYTES
+    ):
+        self.cache_dir = cache_dir
+        self.compression = compression
+        self.max_bytes = max_bytes
+
+    def get_path(self, file_path, **options):
+        stat = os.stat(file_path)
+        key = "|".join(
+            [
+                os.path.abspath(file_path),
+                str(stat.st_mtime_ns),
+                str(stat.st_size),
+                repr(sorted(options.items())),
+            ]
+        )
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest + ".h5")
+
+    def open(self, file_path, **options):
+        """Return the cached entry as an open ``h5py.File`` or None on a miss."""
+        path = self.get_path(file_path, **options)
+        if not os.path.exists(path):
+            return None
+        try:
+            f = h5py.File(path, "r")
+        except OSError:
+            return None
+        if not f.attrs.get("complete", False):
+            f.close()
+            return None
+        # The modification time orders entries for pruning
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return f
+
+    def store(self, file_path, processor, **options):
+        """
+        Write the processor's cube and derived products for ``file_path``.
+        Returns the entry's path, or None if it could not be written.
+        """
+        if self.max_bytes <= 0:
+            return None
+        path = self.get_path(file_path, **options)
+        tmp_path = path + ".tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._write(tmp_path, file_path, processor)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write ingest cache entry for {file_path}: {e}")
+            _remove(tmp_path)
+            return None
+        self.prune(keep=path)
+        return path
+
+    def _write(self, path, file_path, processor):
+        shape = processor.get_shape()
+        with h5py.File(path, "w") as f:
+            f.attrs["source"] = os.path.abspath(file_path)
+            data = None
+            # The cube is stored uncentred; the shifts are stored with it
+            for y0, y1, block in processor.iter_row_blocks(raw=True):
+                if data is None:
+                    data = f.create_dataset(
+                        "data",
+                        shape=shape,
+                        dtype=block.dtype,
+                        chunks=(1, 1) + tuple(shape[2:]),
+                        compression=self.compression,
+                    )
+                data[y0:y1] = block
+            for key, attr in DERIVED_KEYS.items():
+                value = getattr(processor, attr)
+                if value is not None:
+                    f.create_dataset(key, data=np.asarray(value))
+            if processor.stats is not None:
+                group = f.create_group("stats")
+                for key, value in processor.stats.as_dict().items():
+                    group.create_dataset(key, data=value)
+            f.attrs["complete"] = True
+
+    def entries(self):
+        """``(mtime, size, path)`` of the complete entries, oldest first."""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".h5"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        return sorted(entries)
+
+    def prune(self, keep=None):
+        """
+        Remove the least recently used entries until the cache fits in
+        ``max_bytes``; ``keep`` is removed last, if it alone does not fit.
+        Entries that are open elsewhere (Windows) stay.
+        """
+        entries = self.entries()
+        entries.sort(key=lambda entry: entry[2] == keep)
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if _remove(path):
+                total -= size
+
+    def clear(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".h5") or name.endswith(".tmp"):
+                os.remove(os.path.join(self.cache_dir, name))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        return False
+    return True
+
+
+Ingest_Cache = IngestCache()
@@ -5,12 +5,18 @@ class Py4dstemProcessor:
     def __init__(self):
         pass
 
-    def load_data(self, raw_data, x_range, y_range):
+    def load_data(self, raw_data, x_range, y_range, stats=None):
         self.x_range = x_range
         self.y_range = y_range
         self.data_cube = py4DSTEM.DataCube(data=raw_data)
-        self.dp_mean = self.data_cube.get_dp_mean().data
-        self.dp_max = self.data_cube.get_dp_max().data
+        if stats is not None:
+            # Reuse the shared CubeStatistics instead of another pass
+            dp_mean, dp_max = stats.attach_to(self.data_cube)
+        else:
+            dp_mean = self.data_cube.get_dp_mean()
+            dp_max = self.data_cube.get_dp_max()
+        self.dp_mean = dp_mean.data
+        self.dp_max = dp_max.data
         self.probe_semiangle, probe_x, probe_y = self.data_cube.get_probe_size(
             self.data_cube.tree("dp_mean").data,
         )
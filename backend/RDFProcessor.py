@@ -8,6 +8,8 @@ from utils import (
     fit_polynomial,
     cut_at_zero,
     calculate_pdf,
+    r_grid,
+    DEFAULT_R_POINTS,
 )
 
 
@@ -21,14 +23,18 @@ class RDFProcessor:
         self.fit_threshold = 0.9
         self.r_min = 0.0
         self.r_max = 10.0
+        self.r_points = DEFAULT_R_POINTS
+        self.radial_mean = None
         self.element_data = None
         self.scattering_factor = None
         self.scattering_factor_sq = None
 
     def set_image(self, img):
         self.img = img
-        polar_image, _ = radial_profile(self.img)
+        # 极坐标变换只在换图时计算一次，调整参数时复用
+        polar_image, radial_mean = radial_profile(self.img)
         self.polar_img = polar_image
+        self.radial_mean = radial_mean
 
         print("Image set, polar image calculated")
 
@@ -39,7 +45,14 @@ class RDFProcessor:
         return self.polar_img
 
     def set_parameters(
-        self, q_per_pixel, start_index, end_index, fit_threshold, r_min, r_max
+        self,
+        q_per_pixel,
+        start_index,
+        end_index,
+        fit_threshold,
+        r_min,
+        r_max,
+        r_points=None,
     ):
         self.q_per_pixel = np.float64(q_per_pixel)
         self.start_index = np.int64(start_index)
@@ -47,6 +60,8 @@ class RDFProcessor:
         self.fit_threshold = np.float64(fit_threshold)
         self.r_min = np.float64(r_min)
         self.r_max = np.float64(r_max)
+        if r_points is not None:
+            self.r_points = max(1, int(r_points))
 
     def set_element_data(self, element_data):
         self.element_data = element_data
@@ -60,7 +75,7 @@ class RDFProcessor:
         if self.img is None or self.element_data is None:
             raise ValueError("Image and element data must be set before processing")
 
-        polar_image, radial_mean = radial_profile(self.img)
+        radial_mean = self.radial_mean
         s = self.q_per_pixel * np.arange(len(radial_mean)) / np.sqrt(2)
 
         range_indices = np.arange(self.start_index, self.end_index)
@@ -90,8 +105,7 @@ class RDFProcessor:
         ind_y_fit = y_fit[indices]
         ind_modified_phi = ind_phi - ind_y_fit
 
-        step = (self.r_max - self.r_min) / 600
-        r_ranges = np.arange(self.r_min, self.r_max, step)
+        r_ranges = r_grid(self.r_min, self.r_max, self.r_points)
         pdf = calculate_pdf(ind_s, ind_modified_phi, r_ranges)
 
         return {
@@ -104,7 +118,7 @@ class RDFProcessor:
             "ind_s": ind_s.tolist(),
             "ind_modified_phi": ind_modified_phi.tolist(),
             "r_ranges": r_ranges.tolist(),
-            "pdf": pdf,
+            "pdf": pdf.tolist(),
         }
 
     def _calculate_scattering_factor(self, part_s):
@@ -0,0 +1,108 @@
+import pickle
+import threading
+
+import numpy as np
+from abtem.parametrizations import KirklandParametrization
+
+# Kirkland parameters, read once per process
+KIRKLAND_FILE = "kirkland.pkl"
+# Points of the tabulation grid of every element and composition
+TABLE_POINTS = 8192
+
+
+def grid_extent(x_max):
+    """Upper end of the tabulation grid covering ``x_max``: the next power of two."""
+    return 2.0 ** np.ceil(np.log2(max(float(x_max), 2.0**-10)))
+
+
+def composition_key(element_data):
+    """``(element, fraction)`` pairs of the UI's element list, order-independent."""
+    composition = {
+        str(item["atomicNumber"]): item["percentage"] / 100 for item in element_data
+    }
+    return tuple(sorted(composition.items()))
+
+
+class ScatteringFactors:
+    """
+    Process-wide scattering factors of the RDF workflow.
+
+    The Kirkland parametrization is loaded once. Each element's f and f**2
+    are tabulated on a fine grid of the argument x = s**2 of abtem's
+    scattering-factor functions, uniform in s so that the sharp peak of f
+    at small x is resolved, and a composition's weighted sums are
+    tabulated from those. Both are memoized: per element and grid, and
+    per composition and grid. Grids run from 0 to a power of two, so
+    changing the s-range of the fit only builds a new table when it
+    outgrows the current one, and evaluation is an interpolation.
+    """
+
+    def __init__(self, path=KIRKLAND_FILE, points=TABLE_POINTS):
+        self.path = path
+        self.points = points
+        self._parametrization = None
+        self._functions = {}
+        self._element_tables = {}
+        self._composition_tables = {}
+        self._lock = threading.Lock()
+
+    @property
+    def parametrization(self):
+        with self._lock:
+            if self._parametrization is None:
+                with open(self.path, "rb") as f:
+                    self._parametrization = KirklandParametrization(pickle.load(f))
+            return self._parametrization
+
+    def grid(self, extent):
+        return np.linspace(0, np.sqrt(extent), self.points) ** 2
+
+    def element_table(self, element, extent):
+        """``(f, f**2)`` of one element on ``grid(extent)``."""
+        key = (element, extent)
+        if key not in self._element_tables:
+            if element not in self._functions:
+                function = self.parametrization.scattering_factor(element)
+                self._functions[element] = function
+            f = np.asarray(self._functions[element](self.grid(extent)), np.float64)
+            self._element_tables[key] = (f, f**2)
+        return self._element_tables[key]
+
+    def composition_table(self, composition, extent):
+        """Fraction-weighted ``(sum f, sum f**2)`` of a composition key."""
+        key = (composition, extent)
+        if key not in self._composition_tables:
+            f = np.zeros(self.points)
+            f_sq = np.zeros(self.points)
+            for element, fraction in composition:
+                element_f, element_f_sq = self.element_table(element, extent)
+                f += fraction * element_f
+                f_sq += fraction * element_f_sq
+            self._composition_tables[key] = (f, f_sq)
+        return self._composition_tables[key]
+
+    def evaluate(self, composition, x):
+        """Interpolated ``(sum f(x), sum f(x)**2)`` of a composition key."""
+        x = np.asarray(x, dtype=np.float64)
+        extent = grid_extent(x.max()) if x.size else 1.0
+        grid = self.grid(extent)
+        f, f_sq = self.composition_table(composition, extent)
+        return np.interp(x, grid, f), np.interp(x, grid, f_sq)
+
+    def functions(self, element_data):
+        """
+        Callables for the combined f and the combined f**2 of the elements
+        selected in the UI, as ``get_scattering_factor_function`` returns.
+        """
+        composition = composition_key(element_data)
+
+        def combined_function(x):
+            return self.evaluate(composition, x)[0]
+
+        def combined_function_sq(x):
+            return self.evaluate(composition, x)[1]
+
+        return combined_function, combined_function_sq
+
+
+Scattering_Factors = ScatteringFactors()
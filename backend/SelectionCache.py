@@ -0,0 +1,41 @@
+from collections import OrderedDict
+
+
+class SelectionCache:
+    """
+    LRU cache for the per-selection results of the bin-mask handlers.
+
+    Callers key mean diffraction patterns by dataset load id and selection
+    geometry, and rendered images additionally by display parameters and
+    border colour, so moving one ROI only recomputes that ROI.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key, compute=None):
+        """
+        Return the cached value for ``key``, calling ``compute()`` on a miss
+        (or returning None when no ``compute`` is given).
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        if compute is None:
+            return None
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+Selection_Cache = SelectionCache()
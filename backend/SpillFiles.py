@@ -0,0 +1,86 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from loguru import logger
+
+# Parent of the per-process spill directories
+SPILL_ROOT = os.path.join(tempfile.gettempdir(), "pyglass-spill")
+
+
+def _pid_alive(pid):
+    if os.name == "nt":
+        # Files a live process still maps cannot be removed on Windows anyway
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SpillFiles:
+    """
+    Temporary .npy memory maps of cubes derived from lazily opened datasets
+    (centred, binned).
+
+    Each process writes to its own directory under ``root``, which is
+    removed at exit; directories of processes that did not exit cleanly are
+    removed by ``remove_stale``. A file that cannot be removed yet because
+    it is still mapped (Windows) is retried on every later removal and at
+    exit, instead of being forgotten.
+    """
+
+    def __init__(self, root=SPILL_ROOT):
+        self.root = root
+        self.directory = os.path.join(root, str(os.getpid()))
+        self._pending = set()
+        atexit.register(self.cleanup)
+
+    def allocate(self, shape, dtype):
+        """``(memmap, path)`` of a new file of ``shape`` and ``dtype``."""
+        os.makedirs(self.directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            suffix=".npy", dir=self.directory, delete=False
+        ) as f:
+            path = f.name
+        array = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+        return array, path
+
+    def remove(self, paths):
+        """
+        Remove spill files. Drop every array that maps them first; files
+        that are still mapped stay pending.
+        """
+        self._pending.update(path for path in paths if path is not None)
+        for path in list(self._pending):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            self._pending.discard(path)
+
+    def remove_stale(self):
+        """Remove the spill directories of pyglass processes that are gone."""
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if path == self.directory or (name.isdigit() and _pid_alive(int(name))):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+
+    def cleanup(self):
+        self.remove([])
+        if self._pending:
+            logger.warning(f"{len(self._pending)} spill files still in use at exit")
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+Spill_Files = SpillFiles()
@@ -0,0 +1,100 @@
+import itertools
+
+import cv2
+import numpy as np
+
+DEFAULT_TILE_SIZE = 256
+# Process-wide counter, so clients can tell tiles of a replaced image apart
+_versions = itertools.count()
+
+
+class TilePyramid:
+    """
+    Deep-zoom style multi-resolution tiling of one display image.
+
+    Level 0 is the full-resolution image and every further level halves it,
+    down to the first level that fits in a single tile. Levels and encoded
+    tiles are generated on first request and kept, so panning and zooming
+    only encodes tiles that have not been seen before.
+
+    ``image`` may also be a function returning the image, so that images
+    which are published for every frame are only rendered when zoomed into.
+    """
+
+    def __init__(self, image, tile_size=DEFAULT_TILE_SIZE):
+        self._source = image
+        self._image = None
+        self.tile_size = tile_size
+        self.version = next(_versions)
+        self._levels = None
+        self._tiles = {}
+
+    @property
+    def image(self):
+        if self._image is None:
+            image = self._source() if callable(self._source) else self._source
+            self._image = np.asarray(image, dtype=np.float32)
+            self._levels = [self._image]
+        return self._image
+
+    @property
+    def n_levels(self):
+        height, width = self.image.shape[:2]
+        n_levels = 1
+        while max(height, width) > self.tile_size:
+            height, width = (height + 1) // 2, (width + 1) // 2
+            n_levels += 1
+        return n_levels
+
+    def level_shape(self, level):
+        height, width = self.image.shape[:2]
+        for _ in range(level):
+            height, width = (height + 1) // 2, (width + 1) // 2
+        return height, width
+
+    def describe(self):
+        levels = []
+        for level in range(self.n_levels):
+            height, width = self.level_shape(level)
+            levels.append(
+                {
+                    "width": width,
+                    "height": height,
+                    "cols": -(-width // self.tile_size),
+                    "rows": -(-height // self.tile_size),
+                }
+            )
+        return {
+            "version": self.version,
+            "width": self.image.shape[1],
+            "height": self.image.shape[0],
+            "tile_size": self.tile_size,
+            "levels": levels,
+        }
+
+    def get_level(self, level):
+        n_levels = self.n_levels
+        if not 0 <= level < n_levels:
+            raise ValueError(f"Level {level} out of range 0-{n_levels - 1}")
+        while len(self._levels) <= level:
+            previous = self._levels[-1]
+            height, width = self.level_shape(len(self._levels))
+            self._levels.append(
+                cv2.resize(previous, (width, height), interpolation=cv2.INTER_AREA)
+            )
+        return self._levels[level]
+
+    def get_tile(self, level, col, row):
+        """Tile ``(col, row)`` of ``level`` as a float image."""
+        image = self.get_level(level)
+        y0, x0 = row * self.tile_size, col * self.tile_size
+        if not (0 <= y0 < image.shape[0] and 0 <= x0 < image.shape[1]):
+            raise ValueError(f"Tile ({col}, {row}) out of range at level {level}")
+        return image[y0 : y0 + self.tile_size, x0 : x0 + self.tile_size]
+
+    def get_encoded_tile(self, level, col, row, transport):
+        """Encoded tile, cached per transport setting."""
+        key = (level, col, row, transport.key)
+        if key not in self._tiles:
+            self._tiles[key] = transport.encode(self.get_tile(level, col, row))
+        return self._tiles[key]
@@ -0,0 +1,196 @@
+import numpy as np
+
+from ChunkedReduction import Chunked_Reducer
+
+# Above this fraction of active pixels a dense dot product beats gathering
+DENSE_THRESHOLD = 0.25
+
+
+class VirtualDetector:
+    """
+    A virtual detector stored as flat detector-pixel indices and weights.
+
+    Binary masks become unit weights; float masks give weighted detectors.
+    Frames are reduced with a reshaped matrix-vector product, one chunk of
+    scan rows at a time, so the extra memory does not grow with the cube.
+    """
+
+    def __init__(self, indices, weights, detector_shape):
+        self.indices = np.asarray(indices, dtype=np.intp)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.detector_shape = tuple(detector_shape)
+        self.n_pixels = int(np.prod(self.detector_shape))
+        self._dense = None
+
+    @classmethod
+    def from_mask(cls, mask):
+        mask = np.asarray(mask)
+        flat = mask.ravel()
+        indices = np.flatnonzero(flat)
+        return cls(indices, flat[indices], mask.shape)
+
+    @property
+    def density(self):
+        return len(self.indices) / self.n_pixels
+
+    @property
+    def total_weight(self):
+        return self.weights.sum()
+
+    def dense_weights(self):
+        if self._dense is None:
+            self._dense = np.zeros(self.n_pixels, dtype=np.float64)
+            self._dense[self.indices] = self.weights
+        return self._dense
+
+    def reduce(self, block):
+        """Weighted sum over the detector for every frame of ``block``."""
+        flat = block.reshape(-1, self.n_pixels)
+        if self.density > DENSE_THRESHOLD:
+            sums = flat @ self.dense_weights()
+        else:
+            sums = flat[:, self.indices] @ self.weights
+        return sums.reshape(block.shape[:-2])
+
+    def compute(self, processor, normalize=True):
+        """
+        Virtual image of a DM4Processor. With ``normalize`` the weighted sum
+        is divided by the total weight, i.e. the mean over a binary mask.
+        """
+        image = np.zeros(processor.get_shape()[:2], dtype=np.float64)
+
+        def reduce_rows(y0, y1, block):
+            image[y0:y1] = self.reduce(block)
+
+        Chunked_Reducer.map_rows(processor, reduce_rows)
+        if normalize and self.total_weight != 0:
+            image /= self.total_weight
+        return image
+
+
+def circle_mask(shape, center, radius):
+    yy, xx = np.ogrid[: shape[0], : shape[1]]
+    return (xx - center[0]) ** 2 + (yy - center[1]) ** 2 <= radius**2
+
+
+def annular_mask(shape, center, inner_radius, outer_radius):
+    yy, xx = np.ogrid[: shape[0], : shape[1]]
+    r2 = (xx - center[0]) ** 2 + (yy - center[1]) ** 2
+    return (r2 >= inner_radius**2) & (r2 <= outer_radius**2)
+
+
+class VirtualDetectorBank:
+    """
+    Several virtual detectors evaluated together.
+
+    The weights of all detectors are stacked into one (pixels, N) matrix
+    over the union of their active pixels, so every chunk of frames is read
+    once and reduced with a single matrix-matrix product.
+    """
+
+    def __init__(self, detectors=()):
+        self.detectors = []
+        self.detector_shape = None
+        self.n_pixels = 0
+        for detector in detectors:
+            self.add(detector)
+
+    def __len__(self):
+        return len(self.detectors)
+
+    def add(self, detector):
+        if self.detector_shape is None:
+            self.detector_shape = detector.detector_shape
+            self.n_pixels = detector.n_pixels
+        elif detector.detector_shape != self.detector_shape:
+            raise ValueError("All detectors must have the same detector shape")
+        self.detectors.append(detector)
+        self._build()
+
+    def _build(self):
+        self.indices = np.unique(
+            np.concatenate([d.indices for d in self.detectors])
+        )
+        self.weights = np.zeros((len(self.indices), len(self.detectors)))
+        for i, d in enumerate(self.detectors):
+            self.weights[np.searchsorted(self.indices, d.indices), i] = d.weights
+        self.dense = len(self.indices) / self.n_pixels > DENSE_THRESHOLD
+        if self.dense:
+            weights = np.zeros((self.n_pixels, len(self.detectors)))
+            weights[self.indices] = self.weights
+            self.weights = weights
+
+    def reduce(self, block):
+        """(rows, cols, N) weighted sums of ``block`` for every detector."""
+        flat = block.reshape(-1, self.n_pixels)
+        if not self.dense:
+            flat = flat[:, self.indices]
+        sums = flat @ self.weights
+        return sums.reshape(block.shape[:-2] + (len(self.detectors),))
+
+    def compute(self, processor, normalize=True):
+        """Return the (N, rows, cols) stack of virtual images."""
+        images = np.zeros(
+            (len(self.detectors),) + tuple(processor.get_shape()[:2]),
+            dtype=np.float64,
+        )
+
+        def reduce_rows(y0, y1, block):
+            images[:, y0:y1] = np.moveaxis(self.reduce(block), -1, 0)
+
+        Chunked_Reducer.map_rows(processor, reduce_rows)
+        if normalize:
+            for image, detector in zip(images, self.detectors):
+                if detector.total_weight != 0:
+                    image /= detector.total_weight
+        return images
+
+
+class IncrementalVirtualImage:
+    """
+    Virtual image that follows an interactively edited mask.
+
+    The last detector weights and the running weighted-sum image are kept;
+    an edit only reduces the detector pixels whose weight changed, so the
+    cost is proportional to the size of the edit rather than of the mask.
+    """
+
+    # Above this fraction of changed pixels a fresh computation is cheaper
+    FULL_RECOMPUTE_FRACTION = 0.5
+
+    def __init__(self):
+        self.weights = None
+        self.sum_image = None
+        self._source = None
+
+    def reset(self):
+        self.weights = None
+        self.sum_image = None
+        self._source = None
+
+    def update(self, processor, mask):
+        """Return the mean-normalized virtual image for ``mask``."""
+        # Copy, so that later in-place edits of the caller's mask are seen
+        mask = np.array(mask, dtype=np.float64)
+        weights = mask.ravel()
+        source = (id(processor), processor.load_id, mask.shape)
+        delta = None
+        if self._source == source:
+            delta = weights - self.weights
+            changed = np.flatnonzero(delta)
+            if len(changed) > self.FULL_RECOMPUTE_FRACTION * len(weights):
+                delta = None
+
+        if delta is None:
+            detector = VirtualDetector.from_mask(mask)
+            self.sum_image = detector.compute(processor, normalize=False)
+        elif len(changed):
+            detector = VirtualDetector(changed, delta[changed], mask.shape)
+            self.sum_image += detector.compute(processor, normalize=False)
+        self.weights = weights
+        self._source = source
+
+        total = weights.sum()
+        if total == 0:
+            return np.zeros_like(self.sum_image)
+        return self.sum_image / total
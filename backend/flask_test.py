@@ -1,8 +1,10 @@
+import atexit
 import base64
+from concurrent.futures import ThreadPoolExecutor
 import matplotlib
 matplotlib.use('Agg')  # 切换后端为 Agg
 import cv2
-from flask import Flask
+from flask import Flask, has_request_context, request
 from flask_socketio import SocketIO, emit, Namespace
 import numpy as np
 from engineio.async_drivers import gevent
@@ -17,9 +19,25 @@ import matplotlib.pyplot as plt
 from io import BytesIO
 import PIL  
 
-from DM4Processor import DM4_Processor
-from ImageProcessor import ImageProcessor
+from DM4Processor import BinnedFrames
+from DatasetRegistry import Dataset_Registry
+from EventCoalescing import LatestWins
+from FrameCache import Frame_Cache, frame_key
+from FramePrefetch import FramePrefetcher
+from FrameStream import DeltaEncoder, stream_indices
+from ImageCodec import ImageTransport
+from ImageProcessor import DEFAULT_CLIP, ImageProcessor
 from RDFProcessor import RDFProcessor
+from SelectionCache import Selection_Cache
+from SpillFiles import Spill_Files
+from TilePyramid import TilePyramid
+from VirtualDetector import (
+    IncrementalVirtualImage,
+    VirtualDetector,
+    VirtualDetectorBank,
+    annular_mask,
+    circle_mask,
+)
 from XemSimulator import XemSimulator
 from CrystalStrainProcessor import CrystalStrainProcessor
 from CenterCalibrationProcessor import CenCal
@@ -29,6 +47,10 @@ from XemMatcher import XemMatcher
 
 app = Flask(__name__)
 socketio = SocketIO(app, ping_timeout=86400, ping_interval=300,cors_allowed_origins="http://localhost:9300")
+# 滑块和绘制产生的事件按客户端排队，同类事件只处理最新的一个
+latest_wins = LatestWins(socketio.sleep, lambda: socketio.server.eio.create_event())
+# 中心校正、构建金字塔等 CPU 密集任务在真实线程中运行，不占用 gevent 事件循环
+task_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pyglass-task")
 
 
 def hex_to_bgr(hex_color):
@@ -42,54 +64,97 @@ def hex_to_bgr(hex_color):
     return (b, g, r)  # OpenCV使用BGR格式
 
 
-def add_border_to_grayscale(grayscale_image, border_color_hex, border_width=1):
+def add_borders_to_stack(stack, border_colors_hex, border_width=1):
     """
-    在灰度图像内部添加指定颜色的边框
-    :param grayscale_image: 二维NumPy数组，范围0-1，表示灰度图
-    :param border_color_hex: 16进制颜色字符串（例如：'#FF0000'）
-    :param border_width: 边框宽度（默认为10）
-    :return: 带有边框的灰度图像，范围0-1
+    批量为 (N, H, W) 灰度图像（范围 0-1）添加边框，每张图像可以有不同的颜色
+    :return: (N, H, W, 3) 的 BGR 图像，范围 0-1
     """
-    # 确保输入图像范围在0-1之间
-    if grayscale_image.min() < 0 or grayscale_image.max() > 1:
-        raise ValueError("灰度图像的范围必须在0-1之间")
-
-    # 获取图像的尺寸
-    height, width = grayscale_image.shape
-
-    # 将灰度图像转换为BGR格式
-    grayscale_image_8bit = (grayscale_image * 255).astype(np.uint8)
-    bgr_image = cv2.cvtColor(grayscale_image_8bit, cv2.COLOR_GRAY2BGR)
-
-    # 将16进制颜色转换为BGR格式
-    border_color_bgr = hex_to_bgr(border_color_hex)
-
-    # 创建带有边框的区域
-    bgr_image_with_border = bgr_image.copy()
-    bgr_image_with_border[:border_width, :] = border_color_bgr  # 上边框
-    bgr_image_with_border[-border_width:, :] = border_color_bgr  # 下边框
-    bgr_image_with_border[:, :border_width] = border_color_bgr  # 左边框
-    bgr_image_with_border[:, -border_width:] = border_color_bgr  # 右边框
-
-    return bgr_image_with_border.astype(np.float32) / 255.0
-
-
-def get_mask_from_selection(
+    stack_8bit = (np.asarray(stack) * 255).astype(np.uint8)
+    bgr = np.repeat(stack_8bit[..., None], 3, axis=-1)
+    colors = np.array([hex_to_bgr(c) for c in border_colors_hex], dtype=np.uint8)
+    colors = colors[:, None, None, :]
+    bgr[:, :border_width, :] = colors
+    bgr[:, -border_width:, :] = colors
+    bgr[:, :, :border_width] = colors
+    bgr[:, :, -border_width:] = colors
+    return bgr.astype(np.float32) / 255.0
+
+
+def get_selection_bounds(
     selection: dict, original_shape: tuple, scaled_shape: tuple
 ):
+    """
+    将画布上的选区换算为原始尺寸下的 (y, x, height, width)，点选区为 1x1。
+    """
     x = int(selection["attrs"]["x"] / scaled_shape[1] * original_shape[1])
     y = int(selection["attrs"]["y"] / scaled_shape[0] * original_shape[0])
     if selection["className"] == "Rect":
         logger.info(selection["className"])
         width = int(selection["attrs"]["width"] / scaled_shape[1] * original_shape[1])
         height = int(selection["attrs"]["height"] / scaled_shape[0] * original_shape[0])
-        mask = np.zeros(original_shape, dtype=np.bool_)
-        mask[y : y + height, x : x + width] = 1
-        return mask
+        return (y, x, height, width)
     elif selection["className"] == "Circle":
-        mask = np.zeros(original_shape, dtype=np.bool_)
-        mask[y, x] = 1
-        return mask
+        return (y, x, 1, 1)
+
+
+def render_selections(
+    dataset, selections, image_processor, scaled_shape, transport=None
+):
+    """
+    计算每个选区的平均衍射图并加上边框，返回 [(key, 编码后的图像), ...]。
+    结果按选区几何形状、显示参数、边框颜色和编码方式缓存，未变化的选区不会重新计算。
+    """
+    transport = transport or default_transport
+    original_shape = dataset.get_shape()[:2]
+    keys = []
+    for s in selections:
+        bounds = get_selection_bounds(s, original_shape, scaled_shape)
+        mean_key = ("mean", dataset.load_id, bounds)
+        render_key = (
+            "render",
+            mean_key,
+            image_processor.get_params(),
+            s["attrs"]["stroke"],
+            transport.key,
+        )
+        keys.append((bounds, mean_key, render_key, s["attrs"]["stroke"]))
+
+    def mean_of(bounds, mean_key):
+        return Selection_Cache.get(mean_key, lambda: dataset.get_rect_mean(*bounds))
+
+    rendered = {}
+    missing = []
+    for key in keys:
+        rendered[key[2]] = Selection_Cache.get(key[2])
+        if rendered[key[2]] is None:
+            missing.append(key)
+    # 未缓存的选区一次性批量调整显示并加边框
+    if missing:
+        means = np.stack([mean_of(bounds, mean_key) for bounds, mean_key, *_ in missing])
+        bordered = add_borders_to_stack(
+            image_processor.get_stack(means), [stroke for *_, stroke in missing]
+        )
+        for (_, _, render_key, _), img in zip(missing, bordered):
+            rendered[render_key] = transport.encode(img)
+            Selection_Cache.put(render_key, rendered[render_key])
+    if keys:
+        # 与逐个渲染时一样，处理器中保留最后一个选区的平均衍射图
+        bounds, mean_key, _, _ = keys[-1]
+        image_processor.load_img(mean_of(bounds, mean_key))
+    return [(render_key, rendered[render_key]) for _, _, render_key, _ in keys]
+
+
+def selection_preview(dataset, selection, image_processor, scaled_shape):
+    """
+    选区平均衍射图的草图（按固定间隔抽取的部分扫描位置的平均），已调整显示并加上边框，
+    用作渐进式发送的预览。精确结果同样很快时返回 None。
+    """
+    bounds = get_selection_bounds(selection, dataset.get_shape()[:2], scaled_shape)
+    draft = dataset.get_rect_draft(*bounds)
+    if draft is None:
+        return None
+    img = adjust_preview(draft, image_processor.get_params())
+    return add_borders_to_stack(img[None], [selection["attrs"]["stroke"]])[0]
 
 
 def resize_mask(large_mask, original_shape):
@@ -112,61 +177,507 @@ def resize_mask(large_mask, original_shape):
     return small_mask
 
 
-def calculate_average_intensity(gray_images, mask):
+def detector_from_spec(spec: dict, detector_shape: tuple) -> VirtualDetector:
     """
-    计算每张灰度图在选定像素上的平均强度，并形成一个128x128的强度数组。
+    根据前端的描述生成虚拟探测器。
 
     参数:
-    gray_images (numpy.ndarray): 形状为 (128, 128, 256, 256) 的灰度图数组。
-    mask (numpy.ndarray): 形状为 (256, 256) 的mask数组。
-
-    返回:
-    numpy.ndarray: 形状为 (128, 128) 的强度数组。
+    spec (dict): {"mode": "mask", "mask": [[...]]}（画布大小的 mask，可带权重），
+        {"mode": "circle", "radius": r} 或
+        {"mode": "annulus", "inner_radius": r1, "outer_radius": r2}；
+        center 可选，单位为探测器像素，默认为探测器中心。
+    detector_shape (tuple): 探测器尺寸。
     """
-    # 将mask扩展到与gray_images相同的维度
-    mask_expanded = np.broadcast_to(mask, gray_images.shape)
-    print(mask_expanded.shape)
-    # 选择选定像素
-    t1 = time()
-    selected_pixels = gray_images[mask_expanded == 1]
-
-    # 将选定像素重塑为 (128, 128, -1)
-    selected_pixels_reshaped = selected_pixels.reshape(
-        gray_images.shape[0], gray_images.shape[1], -1
-    )
+    mode = spec.get("mode", "mask")
+    center = spec.get("center", (detector_shape[1] / 2, detector_shape[0] / 2))
+    if mode == "circle":
+        mask = circle_mask(detector_shape, center, spec["radius"])
+    elif mode == "annulus":
+        mask = annular_mask(
+            detector_shape, center, spec["inner_radius"], spec["outer_radius"]
+        )
+    elif mode == "mask":
+        mask = resize_mask(np.array(spec["mask"], dtype=np.float64), detector_shape)
+    else:
+        raise ValueError(f"Unknown detector mode: {mode}")
+    return VirtualDetector.from_mask(mask)
 
-    # 计算每张灰度图的平均值
-    intensity_array = np.mean(selected_pixels_reshaped, axis=2)
-    t2 = time()
-    print("Time taken to calculate average intensity:", t2 - t1)
-    return intensity_array
 
+# 未协商传输方式的客户端使用 base64 PNG
+default_transport = ImageTransport()
 
-def convert_to_base64(img: np.ndarray) -> str:
-    img = (img * 255).astype(np.uint8)
-    _, buffer = cv2.imencode(".png", img)
-    image_base64 = base64.b64encode(buffer).decode("utf-8")
-    return image_base64
 
+def virtual_mask_for(mask: np.ndarray, dataset) -> np.ndarray:
+    """
+    将画布大小的 mask 缩放到数据集的探测器尺寸。mask 的值作为探测器权重，
+    0/1 mask 即为普通的二值探测器；空 mask 视为整个探测器。
+    """
+    detector_shape = dataset.get_shape()[2:]
+    virtual_mask = resize_mask(mask, detector_shape)
+    if virtual_mask.sum() == 0:
+        virtual_mask = np.ones(detector_shape, dtype=np.float64)
+    return virtual_mask
+
+
+def image_response(
+    img: np.ndarray,
+    id=None,
+    id2=None,
+    event_name: str = None,
+    transport: ImageTransport = None,
+):
+    ### Encode float image in range 0-1 with the namespace's codec
+    image_data = (transport or default_transport).encode(img)
+    emit_image(image_data, id, id2, event_name)
 
-def image_response(img: np.ndarray, id=None, id2=None, event_name: str = None):
-    ### Convert float image in range 0-1 to uint8 and encode to base64
-    img = (img * 255).astype(np.uint8)
-    _, buffer = cv2.imencode(".png", img)
-    image_base64 = base64.b64encode(buffer).decode("utf-8")
+
+def emit_image(image_data, id=None, id2=None, event_name: str = None, **fields):
+    """发送已编码的图像，事件与 image_response 相同；fields 会一并加入消息"""
+    payload = {"image_data": image_data, **fields}
     if event_name is not None:
-        emit(event_name, {"image_data": image_base64})
+        emit(event_name, payload)
     if id is None:
-        emit("image_response", {"image_data": image_base64})
+        emit("image_response", payload)
     else:
-        emit("image_response", {"image_data": image_base64, "id": id, "id2": id2})
+        emit("image_response", {**payload, "id": id, "id2": id2})
+
+
+# 渐进式渲染中预览图的长边尺寸
+PREVIEW_SIZE = 128
+
+
+def shrink_for_preview(img: np.ndarray) -> np.ndarray:
+    """按整数倍缩小图像，使长边约为 PREVIEW_SIZE"""
+    factor = max(img.shape[:2]) // PREVIEW_SIZE
+    if factor <= 1:
+        return img
+    size = (img.shape[1] // factor, img.shape[0] // factor)
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+
+def adjust_preview(img: np.ndarray, params: tuple, histogram=None) -> np.ndarray:
+    """用给定的显示参数调整缩小后的图像，作为快速预览"""
+    processor = ImageProcessor()
+    processor.updata_params(*params)
+    processor.load_img(shrink_for_preview(img), histogram)
+    return processor.get_img()
+
+
+def adjust_params_from(data: dict) -> tuple:
+    """
+    从前端的 adjust 请求中读取显示参数。auto_contrast 为 None（最小/最大值拉伸）、
+    "percentile"（按 clip 百分位截断）或 "equalize"（直方图均衡化）
+    """
+    return (
+        data["gamma"],
+        data["contrast"],
+        data["brightness"],
+        data.get("log_scale", False),
+        data.get("auto_contrast"),
+        tuple(data.get("clip", DEFAULT_CLIP)),
+    )
 
 
-class ViewerNamespace(Namespace):
+def cube_histogram(dataset):
+    """数据集的整体强度直方图（随统计量一起计算），尚未计算时返回 None"""
+    stats = dataset.stats
+    if stats is None or stats.histogram.total == 0:
+        return None
+    return stats.histogram
+
+
+def get_dataset(data=None):
+    """根据请求中的 dataset_id 获取数据集，缺省时使用当前激活的数据集"""
+    return Dataset_Registry.get(get_dataset_id(data))
+
+
+def get_dataset_id(data=None):
+    """请求中的 dataset_id，缺省时为当前激活的数据集"""
+    dataset_id = data.get("dataset_id") if isinstance(data, dict) else None
+    return Dataset_Registry.active_id if dataset_id is None else dataset_id
+
+
+def frame_dataset(dataset_id, display_size=None):
+    """
+    通过 Dataset_Registry 获取数据集，display_size 不为 None 时为分箱预览。
+    跨事件只保存 dataset_id：被逐出的数据集会在这里按需重新载入，
+    而不是继续使用已经清空的处理器
+    """
+    dataset = Dataset_Registry.get(dataset_id)
+    if display_size is None:
+        return dataset
+    preview = dataset.get_preview(display_size)
+    if isinstance(preview, BinnedFrames):
+        # 分箱数据生成之前逐帧分箱
+        bin_in_background(dataset, preview.factor)
+    return preview
+
+
+def is_preview(data):
+    """请求是否为交互过程中的预览（拖动滑块、绘制选区），预览使用探测器分箱后的数据"""
+    return isinstance(data, dict) and bool(data.get("preview"))
+
+
+def wait_for_centring(dataset_id, attempts=3):
+    """
+    返回中心校正完成后的数据集。需要时与查看器一样通过 /viewer 在后台线程中进行校正
+    （包括被逐出后重新载入的数据集），等待期间让出 gevent 循环，不阻塞其它事件；
+    校正期间数据集被逐出时重新校正
+    """
+    for _ in range(attempts):
+        viewer_namespace.ensure_centring(dataset_id)
+        while dataset_id in viewer_namespace.centring_ids:
+            socketio.sleep(0.1)
+        dataset = Dataset_Registry.get(dataset_id)
+        if not dataset.needs_centring():
+            return dataset
+    raise RuntimeError(f"Centring of {dataset_id} did not finish")
+
+
+def run_in_thread(fn, on_progress=None, poll_interval=0.1):
+    """
+    在 task_executor 的线程中运行 fn(progress_callback) 并返回其结果（异常会重新抛出）。
+    调用方（gevent 协程）在等待期间定期让出事件循环，其它客户端不受影响；
+    线程只记录最新进度，on_progress(done, total) 在事件循环中调用，因此可以安全地 emit。
+    """
+    latest = [None]
+
+    def progress(done, total):
+        latest[0] = (done, total)
+
+    future = task_executor.submit(fn, progress)
+    reported = None
+    while True:
+        done = future.done()
+        if on_progress is not None and latest[0] != reported:
+            reported = latest[0]
+            on_progress(*reported)
+        if done:
+            return future.result()
+        socketio.sleep(poll_interval)
+
+
+# 正在后台生成的分箱数据，(load_id, factor)
+binning_jobs = set()
+
+
+def bin_in_background(dataset, factor):
+    """
+    在 task_executor 的线程中生成 dataset.get_binned(factor)，不阻塞事件循环。
+    中心校正期间不生成：校正完成后分箱数据会作废，之后的请求会重新安排
+    """
+    job = (dataset.load_id, factor)
+    if job in binning_jobs or dataset.has_binned(factor) or dataset.is_centring():
+        return
+    binning_jobs.add(job)
+
+    def build():
+        try:
+            run_in_thread(lambda callback: dataset.get_binned(factor))
+        finally:
+            binning_jobs.discard(job)
+
+    socketio.start_background_task(build)
+
+
+def ready_draft(dataset):
+    """
+    已生成的草图分箱数据；尚未生成时在后台安排生成并返回 None，
+    调用方直接在全分辨率数据上计算，而不是等待一次完整的分箱遍历
+    """
+    draft = dataset.get_draft()
+    if draft is None:
+        bin_in_background(dataset, dataset.draft_factor())
+    return draft
+
+
+class ClientState:
+    """命名空间中每个客户端（request.sid）各自的状态"""
+
+    def __init__(self):
+        self.transport = ImageTransport()
+        # 已发送给前端的 image_series 中每一项的缓存键，用于只发送变化的项
+        self.series_keys = []
+        # 播放模式的编号，开始新的播放或停止时递增，旧的播放任务随之结束
+        self.play_id = 0
+        # 正在播放的数据集
+        self.play_dataset = None
+
+
+class ImageNamespace(Namespace):
+    """
+    发送图像的命名空间。客户端可以通过 set_transport 协商图像的编码方式
+    （raw/png/webp/jpeg）以及是否以二进制附件代替 base64 发送。
+    发布为瓦片金字塔的图像可以通过 get_tile_info / get_tiles 按缩放级别分块获取。
+    命名空间实例由所有客户端共享，各客户端自己的状态保存在 clients 中。
+    """
+
+    def __init__(self, namespace=None):
+        super().__init__(namespace)
+        # sid -> ClientState，断开连接时删除
+        self.clients = {}
+        # 不属于某个请求的后台任务（例如中心校正完成后的广播）使用的状态
+        self.broadcast_state = ClientState()
+        # 图像名 -> TilePyramid，例如 "virtual"、"dp"、"ipf"
+        self.tiles = {}
+
+    def client(self, sid=None):
+        """客户端 sid 的状态，缺省为当前请求的客户端"""
+        if sid is None:
+            if not has_request_context():
+                return self.broadcast_state
+            sid = request.sid
+        if sid not in self.clients:
+            self.clients[sid] = ClientState()
+        return self.clients[sid]
+
+    @property
+    def transport(self):
+        return self.client().transport
+
+    def trigger_event(self, event, *args):
+        try:
+            return super().trigger_event(event, *args)
+        finally:
+            if event == "disconnect" and args:
+                self.clients.pop(args[0], None)
+
+    def send_progressive(self, preview, render, id=None, id2=None, event_name=None):
+        """
+        渐进式发送图像：先发送低分辨率、低质量的预览 preview，再发送 render()
+        返回的已编码全质量图像。若期间收到了同类的新请求，则不再发送全质量图像。
+        """
+        preview_transport = self.transport.preview()
+        emit_image(
+            preview_transport.encode(preview),
+            id,
+            id2,
+            event_name,
+            codec=preview_transport.codec,
+            progressive="preview",
+        )
+        # 让已到达的请求进入队列，以便判断当前请求是否已过期
+        socketio.sleep(0)
+        if latest_wins.superseded():
+            return
+        emit_image(
+            render(),
+            id,
+            id2,
+            event_name,
+            codec=self.transport.codec,
+            progressive="final",
+        )
+
+    def publish_tiles(self, name, image):
+        """以全分辨率图像替换名为 name 的瓦片金字塔，瓦片在请求时才生成"""
+        self.tiles[name] = TilePyramid(image)
+
+    def on_get_tile_info(self, data):
+        name = data["image"]
+        if name not in self.tiles:
+            emit("tile_info_response", {"success": False, "image": name})
+            return
+        emit(
+            "tile_info_response",
+            {"success": True, "image": name, **self.tiles[name].describe()},
+        )
+
+    def on_get_tiles(self, data):
+        """
+        发送当前视野内的瓦片。data: {"image", "level", "tiles": [[col, row], ...],
+        "version"}；version 与当前金字塔不一致时说明图像已更新，不再发送旧瓦片。
+        """
+        try:
+            name = data["image"]
+            pyramid = self.tiles.get(name)
+            level = int(data["level"])
+            tiles = list(data["tiles"])
+        except (TypeError, ValueError, KeyError) as e:
+            emit("tile_response", {"success": False, "error": str(e)})
+            return
+        if pyramid is None or data.get("version", pyramid.version) != pyramid.version:
+            emit("tile_response", {"success": False, "image": name})
+            return
+        for tile in tiles:
+            try:
+                col, row = tile
+                image_data = pyramid.get_encoded_tile(level, col, row, self.transport)
+            except (TypeError, ValueError, KeyError) as e:
+                emit("tile_response", {"success": False, "error": str(e)})
+                continue
+            emit(
+                "tile_response",
+                {
+                    "success": True,
+                    "image": name,
+                    "version": pyramid.version,
+                    "level": level,
+                    "col": col,
+                    "row": row,
+                    "image_data": image_data,
+                },
+            )
+
+    def on_set_transport(self, data):
+        try:
+            settings = self.transport.configure(**data)
+        except (TypeError, ValueError) as e:
+            emit("transport_response", {"success": False, "error": str(e)})
+            return
+        emit("transport_response", {"success": True, **settings})
+
+
+class ViewerNamespace(ImageNamespace):
     def __init__(self, namespace=None):
         super().__init__(namespace)
         self.right_processer = ImageProcessor()
         self.left_processer = ImageProcessor()
+        self.index = None
+        # 右侧显示的扫描帧 (dataset_id, index, display_size)，拖动预览时
+        # display_size 为预览尺寸；显示选区平均图时为 None
+        self.right_frame = None
+        # right_processer 中已载入的帧 (load_id, index, 是否使用整体直方图)
+        self.right_loaded = None
+        # 记录上一次的虚拟 mask 和累加图，编辑 mask 时只计算变化的像素
+        self.virtual_image = IncrementalVirtualImage()
+        # 绘制 mask 过程中在分箱数据上的草图
+        self.draft_virtual_image = IncrementalVirtualImage()
+        # 按拖动方向在后台预取相邻的帧
+        self.prefetcher = FramePrefetcher()
+        # 已启动中心校正任务的数据集
+        self.centring_ids = set()
+        # 右侧自动对比度使用的直方图："frame" 为每帧自身，"cube" 为整个数据集
+        self.right_scope = "frame"
+        Dataset_Registry.on_evict(self.dataset_evicted)
+
+    def dataset_evicted(self, dataset_id):
+        """数据集被逐出或移除后，停止使用它的后台任务，并丢弃对已移除数据集的引用"""
+        self.prefetcher.cancel()
+        if dataset_id in Dataset_Registry:
+            # 仅被逐出：右侧帧和播放通过 dataset_id 按需重新载入
+            return
+        if self.right_frame is not None and self.right_frame[0] == dataset_id:
+            self.right_frame = None
+            self.right_loaded = None
+        for client in self.clients.values():
+            if client.play_dataset == dataset_id:
+                client.play_id += 1
+                client.play_dataset = None
+
+    def center_in_background(self, dataset_id):
+        """后台线程中逐块进行中心校正，并通过 /viewer 推送进度"""
+        dataset = Dataset_Registry.get(dataset_id)
+        load_id = dataset.load_id
+
+        def progress(done, total):
+            socketio.emit(
+                "centring_progress",
+                {
+                    "dataset_id": dataset_id,
+                    "done": done,
+                    "total": total,
+                    "progress": done / total,
+                },
+                namespace=self.namespace,
+            )
+
+        try:
+            success = run_in_thread(dataset.center_direct_beam, progress)
+        finally:
+            self.centring_ids.discard(dataset_id)
+        if not success:
+            return
+        socketio.emit(
+            "centring_done",
+            {"success": True, "dataset_id": dataset_id},
+            namespace=self.namespace,
+        )
+        # 校正前缓存的帧已过期；用校正后的图像替换当前显示的帧
+        Frame_Cache.invalidate(load_id)
+        self.right_loaded = None
+        if self.index is not None and Dataset_Registry.active_id == dataset_id:
+            self.right_frame = (dataset_id, self.index, None)
+            socketio.emit(
+                "right_image_response",
+                {"image_data": self.right_frame_data()},
+                namespace=self.namespace,
+            )
+            self.publish_right_frame()
+
+    def right_frame_data(self):
+        """
+        当前右侧帧的编码图像。按 (数据集, 帧, 显示参数, 编码) 缓存，
+        来回拖动或重复请求时直接返回缓存，不再读取、调整和编码。
+        """
+        def encode():
+            self.load_right_frame()
+            return self.transport.encode(self.right_processer.get_img())
+
+        return Frame_Cache.get(self.right_frame_key(), encode)
+
+    def right_dataset(self):
+        dataset_id, _, display_size = self.right_frame
+        dataset = frame_dataset(dataset_id, display_size)
+        self.ensure_centring(dataset_id)
+        return dataset
+
+    def right_frame_key(self):
+        dataset, index = self.right_dataset(), self.right_frame[1]
+        return frame_key(
+            dataset,
+            index,
+            self.right_processer.get_params(),
+            self.transport.key,
+            self.right_histogram(dataset),
+        )
+
+    def right_histogram(self, dataset):
+        """
+        右侧帧自动对比度所用的共享直方图。使用整体直方图时所有帧的对比度一致，
+        且无需为每帧统计；返回 None 时使用每帧自身的直方图
+        """
+        if self.right_scope != "cube" or self.right_processer.auto_contrast is None:
+            return None
+        return cube_histogram(dataset)
+
+    def load_right_frame(self):
+        dataset, index = self.right_dataset(), self.right_frame[1]
+        histogram = self.right_histogram(dataset)
+        loaded = (dataset.load_id, index, histogram is not None)
+        if self.right_loaded != loaded:
+            self.right_processer.load_img(dataset.get_img(index), histogram)
+            self.right_loaded = loaded
+
+    def send_right_frame(self, progressive=True):
+        """发送当前右侧帧；未缓存时先发送缩小的预览，再发送全分辨率图像"""
+        if not progressive or self.right_frame_key() in Frame_Cache:
+            emit_image(self.right_frame_data(), event_name="right_image_response")
+            return
+        self.load_right_frame()
+        preview = adjust_preview(
+            self.right_processer.raw_img,
+            self.right_processer.get_params(),
+            self.right_histogram(self.right_dataset()),
+        )
+        self.send_progressive(
+            preview, self.right_frame_data, event_name="right_image_response"
+        )
+
+    def publish_right_frame(self):
+        """将当前右侧帧发布为 "dp" 瓦片金字塔，只有在放大查看时才渲染"""
+        dataset_id, index, display_size = self.right_frame
+        params = self.right_processer.get_params()
+        histogram = self.right_histogram(self.right_dataset())
+
+        def render():
+            processor = ImageProcessor()
+            processor.updata_params(*params)
+            dataset = frame_dataset(dataset_id, display_size)
+            processor.load_img(dataset.get_img(index), histogram)
+            return processor.get_img()
+
+        self.publish_tiles("dp", render)
 
     def on_connect(self):
         print("Client connected: ViwerNamespace")
@@ -174,86 +685,333 @@ class ViewerNamespace(Namespace):
     def on_disconnect(self):
         print("Client disconnected: ViwerNamespace")
 
-    def on_upload_dm4(self, file_path):
-        print(file_path)
-        DM4_Processor.load_file(file_path)
-        shape = DM4_Processor.get_shape()
-        self.bin_mask_shape = shape[:2]
-        self.virtual_mask_shape = shape[2:]
+    def on_upload_dm4(self, data):
+        print(data)
+        # data 可以是文件路径，也可以是 {"file_path", "lazy", "dataset_id"}
+        if isinstance(data, dict):
+            dataset_id = Dataset_Registry.load(
+                data["file_path"],
+                dataset_id=data.get("dataset_id"),
+                lazy=data.get("lazy"),
+            )
+        else:
+            dataset_id = Dataset_Registry.load(data)
+        dataset = Dataset_Registry.get(dataset_id)
+        shape = dataset.get_shape()
         index_range = shape[0] * shape[1]
+        self.index = None
         emit(
             "file_name_response",
-            {"success": True, "index_range": index_range},
+            {"success": True, "index_range": index_range, "dataset_id": dataset_id},
+        )
+        self.ensure_centring(dataset_id)
+
+    def ensure_centring(self, dataset_id):
+        """新载入、从缓存打开或被逐出后重新载入的数据集，在后台线程中进行中心校正"""
+        if dataset_id in self.centring_ids:
+            return
+        if Dataset_Registry.get(dataset_id).needs_centring():
+            self.centring_ids.add(dataset_id)
+            socketio.start_background_task(self.center_in_background, dataset_id)
+
+    def on_select_dataset(self, data):
+        Dataset_Registry.select(data["dataset_id"])
+        self.index = None
+        self.ensure_centring(data["dataset_id"])
+        shape = Dataset_Registry.get().get_shape()
+        emit(
+            "file_name_response",
+            {
+                "success": True,
+                "index_range": shape[0] * shape[1],
+                "dataset_id": data["dataset_id"],
+            },
         )
 
+    def on_list_datasets(self, data=None):
+        emit("list_datasets_response", {"datasets": Dataset_Registry.list()})
+
+    def on_remove_dataset(self, data):
+        Dataset_Registry.remove(data["dataset_id"])
+        emit("list_datasets_response", {"datasets": Dataset_Registry.list()})
+
+    def build_pyramid_in_background(self, dataset_id, max_level):
+        """
+        后台线程中构建实空间块求和金字塔，完成后矩形选区的平均衍射图只需读取少量块和
+        """
+        dataset = Dataset_Registry.get(dataset_id)
+
+        def progress(done, total):
+            socketio.emit(
+                "block_pyramid_progress",
+                {"dataset_id": dataset_id, "progress": done / total},
+                namespace=self.namespace,
+            )
+
+        success = run_in_thread(
+            lambda callback: dataset.build_pyramid(max_level, callback), progress
+        )
+        socketio.emit(
+            "block_pyramid_done",
+            {"success": success, "dataset_id": dataset_id},
+            namespace=self.namespace,
+        )
+
+    def on_build_block_pyramid(self, data=None):
+        # 金字塔约占数据体积的 2/3（float32），因此需要显式请求
+        data = data or {}
+        dataset_id = data.get("dataset_id") or Dataset_Registry.active_id
+        socketio.start_background_task(
+            self.build_pyramid_in_background, dataset_id, data.get("max_level")
+        )
+
+    @latest_wins()
     def on_update_bin_mask(self, data):
         print("update bin mask")
+        dataset = get_dataset(data)
+        if is_preview(data):
+            dataset = ready_draft(dataset) or dataset
         selections = [json.loads(s) for s in data["all_selections"]]
-
-        img_series = []
-        for s in selections:
-            bin_mask = get_mask_from_selection(
-                s, self.bin_mask_shape, (data["height"], data["width"])
-            )
-            bin_img = DM4_Processor.raw_data[bin_mask].mean(axis=0)
-            self.right_processer.load_img(bin_img)
-            img = self.right_processer.get_img()
-            border_img = add_border_to_grayscale(
-                img, border_color_hex=s["attrs"]["stroke"]
+        scaled_shape = (data["height"], data["width"])
+        # 右侧改为显示选区平均图
+        self.right_frame = None
+        self.right_loaded = None
+        client = self.client()
+        if selections == []:
+            client.series_keys = []
+            emit("image_series_update", {"length": 0, "changed": {}})
+            return
+        entries = []
+
+        def render():
+            entries.extend(
+                render_selections(
+                    dataset,
+                    selections,
+                    self.right_processer,
+                    scaled_shape,
+                    self.transport,
+                )
             )
-            img_base64 = convert_to_base64(border_img)
-            img_series.append(img_base64)
-        if img_series == []:
-            emit("image_series_response", {"image_series": []})
-        emit("right_image_response", {"image_data": img_series[-1]})
-        emit("image_series_response", {"image_series": img_series[::-1][1:]})
+            return entries[-1][1]
 
+        preview = None
+        if not is_preview(data):
+            preview = selection_preview(
+                dataset, selections[-1], self.right_processer, scaled_shape
+            )
+        if preview is None:
+            emit("right_image_response", {"image_data": render()})
+        else:
+            # 大选区先发送抽样平均的草图
+            self.send_progressive(preview, render, event_name="right_image_response")
+            if entries == []:
+                return
+
+        # 只发送新增或发生变化的选区图像
+        series = entries[::-1][1:]
+        changed = {
+            i: img
+            for i, (key, img) in enumerate(series)
+            if i >= len(client.series_keys) or client.series_keys[i] != key
+        }
+        client.series_keys = [key for key, _ in series]
+        emit("image_series_update", {"length": len(series), "changed": changed})
+
+    @latest_wins()
     def on_update_virtual_mask(self, data):
-        print("update virtual mask")
-        virtual_mask = resize_mask(
-            np.array(data["mask"]), self.virtual_mask_shape
-        ).astype(np.bool_)
-        if virtual_mask.sum() == 0:
-            virtual_mask = np.ones(self.virtual_mask_shape, dtype=np.bool_)
-        print("virtual mask shape:", virtual_mask.shape)
-        print("virtual mask:", virtual_mask.sum())
-        virtual_img = calculate_average_intensity(DM4_Processor.raw_data, virtual_mask)
+        dataset = get_dataset(data)
+        mask = np.array(data["mask"], dtype=np.float64)
+        if is_preview(data):
+            # 绘制过程中在分箱数据上计算草图，松开后再计算全分辨率结果；
+            # 分箱数据生成之前直接计算全分辨率结果
+            draft = ready_draft(dataset)
+            if draft is None:
+                img = self.render_virtual_image(dataset, mask, self.virtual_image)
+            else:
+                img = self.render_virtual_image(draft, mask, self.draft_virtual_image)
+            emit_image(self.transport.encode(img), event_name="left_image_response")
+            return
+
+        def render():
+            img = self.render_virtual_image(dataset, mask, self.virtual_image)
+            return self.transport.encode(img)
+
+        draft = ready_draft(dataset) if dataset.wants_draft() else None
+        if draft is None:
+            emit_image(render(), event_name="left_image_response")
+            return
+        # 数据较大且分箱数据已生成时，先发送草图作为预览
+        draft_mask = virtual_mask_for(mask, draft)
+        draft_img = self.draft_virtual_image.update(draft, draft_mask)
+        preview = adjust_preview(draft_img, self.left_processer.get_params())
+        self.send_progressive(preview, render, event_name="left_image_response")
+
+    def render_virtual_image(self, dataset, mask, virtual_image):
+        """计算虚拟图像并调整显示，同时发布为 "virtual" 瓦片金字塔"""
+        virtual_mask = virtual_mask_for(mask, dataset)
+        virtual_img = virtual_image.update(dataset, virtual_mask)
         self.left_processer.load_img(virtual_img)
-        image_response(self.left_processer.get_img(), event_name="left_image_response")
+        img = self.left_processer.get_img()
+        self.publish_tiles("virtual", img)
+        return img
+
+    def on_update_virtual_detector_bank(self, data):
+        """一次遍历数据计算多个虚拟探测器（BF、ADF、HAADF、自定义 mask 等）的图像"""
+        dataset = get_dataset(data)
+        detector_shape = dataset.get_shape()[2:]
+        bank = VirtualDetectorBank(
+            detector_from_spec(spec, detector_shape) for spec in data["detectors"]
+        )
+        images = bank.compute(dataset)
+        img_series = [
+            self.transport.encode(img) for img in self.left_processer.get_stack(images)
+        ]
+        emit(
+            "virtual_bank_response",
+            {
+                "image_series": img_series,
+                "names": [spec.get("name") for spec in data["detectors"]],
+            },
+        )
 
+    @latest_wins()
     def on_set_index(self, data):
         # logger.info(f"set index: {data}")
         index = int(data["index"])
-        img = DM4_Processor.get_img(index)
-        self.right_processer.load_img(img)
-        image_response(
-            self.right_processer.get_img(), event_name="right_image_response"
+        self.index = index
+        display_size = data.get("display_size", 256) if is_preview(data) else None
+        self.right_frame = (get_dataset_id(data), index, display_size)
+        dataset = self.right_dataset()
+        # 拖动过程中的预览请求已使用分箱数据，无需再分两步发送
+        self.send_right_frame(progressive=not is_preview(data))
+        self.publish_right_frame()
+        self.prefetcher.observe(
+            dataset,
+            index,
+            self.right_processer.get_params(),
+            self.transport,
+            self.right_histogram(dataset),
         )
 
+    def on_play(self, data):
+        """
+        连续播放一组帧：data 为 {"row": y}、{"path": [[y, x], ...]} 或
+        {"start", "stop", "step"}，可选 "fps"（默认 10）和 "loop"。
+        帧之间使用差分压缩，通过 play_frame 事件推送。
+        返回值作为确认发回客户端，其中的 play_id 用于筛选本次播放的帧。
+        """
+        dataset_id = get_dataset_id(data)
+        try:
+            indices = stream_indices(data, frame_dataset(dataset_id).get_shape()[:2])
+            fps = float(data.get("fps", 10))
+            if not 0 < fps < np.inf:
+                raise ValueError(f"Invalid fps: {fps}")
+        except (KeyError, TypeError, ValueError) as e:
+            emit("play_done", {"success": False, "error": str(e)})
+            return {"success": False, "error": str(e)}
+        client = self.client()
+        client.play_id += 1
+        client.play_dataset = dataset_id
+        socketio.start_background_task(
+            self.play_in_background,
+            request.sid,
+            client.play_id,
+            dataset_id,
+            indices,
+            fps,
+            bool(data.get("loop", False)),
+        )
+        return {"success": True, "play_id": client.play_id}
+
+    def on_stop_play(self, data=None):
+        self.client().play_id += 1
+
+    def play_in_background(self, sid, play_id, dataset_id, indices, fps, loop):
+        """向客户端 sid 推送帧；该客户端开始新的播放、停止或断开连接时结束"""
+        encoder = DeltaEncoder()
+        processor = ImageProcessor()
+        interval = 1 / max(fps, 0.1)
+        next_time = time()
+        seq = 0
+        while True:
+            for index in indices:
+                client = self.clients.get(sid)
+                if client is None or client.play_id != play_id:
+                    return
+                # 显示参数可在播放过程中调整；数据集被逐出后会重新载入
+                dataset = frame_dataset(dataset_id)
+                processor.updata_params(*self.right_processer.get_params())
+                processor.load_img(
+                    dataset.get_img(index), self.right_histogram(dataset)
+                )
+                kind, shape, payload = encoder.encode(processor.get_img())
+                if not client.transport.binary:
+                    payload = base64.b64encode(payload).decode("utf-8")
+                socketio.emit(
+                    "play_frame",
+                    {
+                        "play_id": play_id,
+                        "seq": seq,
+                        "index": index,
+                        "kind": kind,
+                        "shape": shape,
+                        "data": payload,
+                    },
+                    namespace=self.namespace,
+                    to=sid,
+                )
+                seq += 1
+                next_time += interval
+                # 处理跟不上目标帧率时不再累积延迟
+                next_time = max(next_time, time())
+                socketio.sleep(next_time - time())
+            if not loop:
+                break
+        socketio.emit(
+            "play_done",
+            {"success": True, "play_id": play_id},
+            namespace=self.namespace,
+            to=sid,
+        )
+
+    def on_set_prefetch(self, data):
+        """设置预取深度（沿拖动方向的帧数）和每轮预取的字节上限"""
+        settings = self.prefetcher.configure(data.get("depth"), data.get("max_bytes"))
+        emit("prefetch_response", settings)
+
+    @latest_wins(key=lambda data: data["side"])
     def on_request_image(self, data):
         if data["side"] == "left":
+            img = self.left_processer.get_img()
+            self.publish_tiles("virtual", img)
             image_response(
-                self.left_processer.get_img(), event_name="left_image_response"
+                img, event_name="left_image_response", transport=self.transport
             )
+        elif data["side"] == "right" and self.right_frame is not None:
+            self.send_right_frame()
+            self.publish_right_frame()
         elif data["side"] == "right":
             image_response(
-                self.right_processer.get_img(), event_name="right_image_response"
+                self.right_processer.get_img(),
+                event_name="right_image_response",
+                transport=self.transport,
             )
 
+    @latest_wins(key=lambda data: data["side"])
     def on_update_adjust_params(self, data):
         logger.info(f"on_update_adjust_params: {data}")
-        gamma = data["gamma"]
-        contrast = data["contrast"]
-        brightness = data["brightness"]
-        log_scale = data["log_scale"]
+        params = adjust_params_from(data)
         side = data["side"]
         if side == "left":
-            self.left_processer.updata_params(gamma, contrast, brightness, log_scale)
+            self.left_processer.updata_params(*params)
         elif side == "right":
-            self.right_processer.updata_params(gamma, contrast, brightness, log_scale)
+            self.right_processer.updata_params(*params)
+            # 自动对比度使用每帧自身还是整个数据集的直方图
+            self.right_scope = data.get("auto_scope", "frame")
 
 
-class RDFNamespace(Namespace):
+class RDFNamespace(ImageNamespace):
     def __init__(self, namespace=None):
         super().__init__(namespace)
         self.rdf_processor = RDFProcessor()
@@ -262,7 +1020,7 @@ class RDFNamespace(Namespace):
         self.right_processer = ImageProcessor()
         self.left_processer = ImageProcessor()
         self.rdf_processor = RDFProcessor()
-        # shape = DM4_Processor.get_shape()
+        # shape = get_dataset().get_shape()
         # self.bin_mask_shape = shape[:2]
         # self.virtual_mask_shape = shape[2:]
         logger.info("Client connected: RDFNamespace")
@@ -270,36 +1028,49 @@ class RDFNamespace(Namespace):
     def on_disconnect(self):
         logger.info("Client disconnected: RDFNamespace")
         
+    @latest_wins()
     def on_update_bin_mask(self, data):
         logger.info(f"update bin mask")
-        shape = DM4_Processor.get_shape()
+        dataset = get_dataset(data)
+        shape = dataset.get_shape()
         self.bin_mask_shape = shape[:2]
         self.virtual_mask_shape = shape[2:]
+        if is_preview(data):
+            dataset = ready_draft(dataset) or dataset
         # logger.info(f"update bin mask: {data}")
         selections = [json.loads(s) for s in data["all_selections"]]
-
-        img_series = []
-        for s in selections:
-            bin_mask = get_mask_from_selection(
-                s, self.bin_mask_shape, (data["height"], data["width"])
+        if selections == []:
+            emit("image_series_response", {"image_series": []})
+            return
+        # 只显示最后一个选区，其余选区无需计算
+        scaled_shape = (data["height"], data["width"])
+
+        def render():
+            entries = render_selections(
+                dataset,
+                selections[-1:],
+                self.right_processer,
+                scaled_shape,
+                self.transport,
             )
-            bin_img = DM4_Processor.raw_data[bin_mask].mean(axis=0)
-            self.right_processer.load_img(bin_img)
-            img = self.right_processer.get_img()
-            border_img = add_border_to_grayscale(
-                img, border_color_hex=s["attrs"]["stroke"]
+            return entries[-1][1]
+
+        preview = None
+        if not is_preview(data):
+            preview = selection_preview(
+                dataset, selections[-1], self.right_processer, scaled_shape
             )
-            img_base64 = convert_to_base64(border_img)
-            img_series.append(img_base64)
-        if img_series == []:
-            emit("image_series_response", {"image_series": []})
-        # print(img_series[-1])
-        emit("right_image_response", {"image_data": img_series[-1]})
+        if preview is None:
+            emit("right_image_response", {"image_data": render()})
+        else:
+            self.send_progressive(preview, render, event_name="right_image_response")
 
     def on_load_image_rdf(self, data):
         print("rdf namespace load image")
-        self.rdf_processor.set_image(DM4_Processor.get_mean_img())
+        dataset = wait_for_centring(get_dataset_id(data))
+        self.rdf_processor.set_image(dataset.get_mean_img())
 
+    @latest_wins()
     def on_update_adjust_params(self, data):
         # print("update adjust params")
         gamma = data["gamma"]
@@ -314,6 +1085,7 @@ class RDFNamespace(Namespace):
         self.rdf_processor.set_scattering_factor_function()
         emit("success", {"success": True})
 
+    @latest_wins()
     def on_update_rdf_params(self, data):
         self.rdf_processor.set_parameters(
             data["qPerPixel"],
@@ -322,10 +1094,12 @@ class RDFNamespace(Namespace):
             data["fitThreshold"],
             data["rMin"],
             data["rMax"],
+            data.get("rPoints"),
         )
         result = self.rdf_processor.process()
         emit("rdf_result_response", result)
 
+    @latest_wins()
     def on_request_img_with_range(self, data):
         start_index = data["startIndex"]
         end_index = data["endIndex"]
@@ -342,8 +1116,14 @@ class RDFNamespace(Namespace):
         cv2.circle(img_color, center, int(start_index / np.sqrt(2)), (0, 0, 1), 1)
         cv2.circle(img_color, center, int(end_index / np.sqrt(2)), (0, 0, 1), 1)
 
-        image_response(img_color, "rdf_left")
+        # 先发送缩小的 JPEG 预览，再发送全分辨率图像
+        self.send_progressive(
+            shrink_for_preview(img_color),
+            lambda: self.transport.encode(img_color),
+            "rdf_left",
+        )
 
+    @latest_wins()
     def on_request_polar_img_with_range(self, data):
         start_index = data["startIndex"]
         end_index = data["endIndex"]
@@ -374,10 +1154,14 @@ class RDFNamespace(Namespace):
             2,
         )
 
-        image_response(img_color, "rdf_right")
+        self.send_progressive(
+            shrink_for_preview(img_color),
+            lambda: self.transport.encode(img_color),
+            "rdf_right",
+        )
 
 
-class CenterCalibrationNamespace(Namespace):
+class CenterCalibrationNamespace(ImageNamespace):
     def __init__(self, namespace=None):
         super().__init__(namespace)
         self.image_processer = ImageProcessor()
@@ -398,30 +1182,32 @@ class CenterCalibrationNamespace(Namespace):
 
     def on_request_image(self, index):
         index = int(index)
-        img = DM4_Processor.get_img(index)
+        img = get_dataset().get_img(index)
 
         self.image_processer.load_img(img)
         processed_img = self.image_processer.get_img()
         img_color = cv2.cvtColor(processed_img, cv2.COLOR_GRAY2BGR)
         center = (img.shape[1] // 2, img.shape[0] // 2)
         cv2.circle(img_color, center, 3, (0, 0, 1), -1)
-        image_response(img_color, "center_calibration")
+        image_response(img_color, "center_calibration", transport=self.transport)
 
     def on_request_calibrated_image(self, data):
         index = int(data["index"])
         thres = float(data["threshold"])
 
-        self.center_cal_processor.load_img(DM4_Processor.get_img(index))
+        self.center_cal_processor.load_img(get_dataset(data).get_img(index))
         corrected_img = self.center_cal_processor.calibrate_center(thres)
         self.image_processer.load_img(corrected_img)
         processed_img = self.image_processer.get_img()
         img_color = cv2.cvtColor(processed_img, cv2.COLOR_GRAY2BGR)
         center = (processed_img.shape[1] // 2, processed_img.shape[0] // 2)
         cv2.circle(img_color, center, 3, (0, 0, 1), -1)
-        image_response(img_color, "center_calibration", "after")
+        image_response(
+            img_color, "center_calibration", "after", transport=self.transport
+        )
 
     def on_get_range(self):
-        x_range, y_range = DM4_Processor.get_range()
+        x_range, y_range = get_dataset().get_range()
         index_range = x_range * y_range
         print(index_range)
         emit(
@@ -439,7 +1225,8 @@ class Py4DSTEMNamespace(Namespace):
     
     def on_load_data(self, data):
         logger.info(f"Py4DSTEM: load data {data}")
-        self.processor.load_data(DM4_Processor.raw_data)
+        dataset = wait_for_centring(get_dataset_id(data))
+        self.processor.load_data(dataset.raw_data, stats=dataset.get_statistics())
     
     def on_set_guess_center(self, data):
         logger.info(f"Py4DSTEM: set guess center {data}")
@@ -520,7 +1307,8 @@ class XemSimulatorNamespace(Namespace):
     
     def on_do_matching(self):
         logger.info(f"XemSimulatorNamespace: do matching")
-        self.matcher.load_data(DM4_Processor.dp)
+        dataset = wait_for_centring(get_dataset_id())
+        self.matcher.load_data(dataset.dp)
         self.matcher.set_pixel_size(self.simulator.pixel_size)
         self.matcher.load_simulations(self.simulator.diffraction_library)
         self.matcher.do_matching()
@@ -532,7 +1320,7 @@ class XemSimulatorNamespace(Namespace):
         emit("save_result_success", {"success": True})
         
 
-class XemACOMViewerNamespace(Namespace):
+class XemACOMViewerNamespace(ImageNamespace):
     def on_connect(self):
         logger.info("connect to XemACOMViewerNamespace")
         self.viewer = XemACOMViewer()
@@ -543,7 +1331,8 @@ class XemACOMViewerNamespace(Namespace):
         
     def on_load_data(self):
         logger.info(f"XemACOMViewerNamespace: load data")
-        self.viewer.load_data(DM4_Processor.dp)
+        dataset = wait_for_centring(get_dataset_id())
+        self.viewer.load_data(dataset.dp)
         # self.viewer.set_pixel_size(0.0162)
         logger.info(f"XemACOMViewerNamespace: load_data_success")
         emit("load_data_success", {"success": True})
@@ -576,7 +1365,9 @@ class XemACOMViewerNamespace(Namespace):
         legend = self.viewer.get_legend()
         legend = legend[:, :, [2, 1, 0]]
         resized_legend = cv2.resize(legend, (int(legend.shape[1]/4), int(legend.shape[0]/4)), interpolation=cv2.INTER_AREA)
-        image_response(resized_legend, event_name="update_legend")
+        image_response(
+            resized_legend, event_name="update_legend", transport=self.transport
+        )
     
     def on_get_ipf(self, data):
         logger.info(f"XemACOMViewerNamespace: get ipf {data}")
@@ -584,17 +1375,17 @@ class XemACOMViewerNamespace(Namespace):
         threshold = data["threshold"]
         rgb_all = self.viewer.get_ipf(direction, threshold)
         bgr_image = rgb_all[:, :, [2, 1, 0]]
+        # 全分辨率的取向图以瓦片形式提供，概览图仍缩放到 256x256
+        self.publish_tiles("ipf", bgr_image)
         zoom_factor = (256/bgr_image.shape[0], 256/bgr_image.shape[1], 1)
         resized_image = scipy.ndimage.zoom(bgr_image, zoom_factor, order=0)
-        image_response(resized_image, event_name="get_ipf_success")
+        image_response(
+            resized_image, event_name="get_ipf_success", transport=self.transport
+        )
 
     def on_update_adjust_params(self, data):
         logger.info(f"XemACOMViewerNamespace: update adjust params {data}")
-        gamma = data["gamma"]
-        contrast = data["contrast"]
-        brightness = data["brightness"]
-        log_scale = data["log_scale"]
-        self.image_processer.updata_params(gamma, contrast, brightness, log_scale)
+        self.image_processer.updata_params(*adjust_params_from(data))
 
     def on_update_virtual_mask(self, data):
         logger.info(f"XemACOMViewerNamespace: update virtual mask {data}")
@@ -623,7 +1414,7 @@ class XemACOMViewerNamespace(Namespace):
         buffer_.seek(0)
         img = PIL.Image.open(buffer_)
         img_array =  np.asarray(img) /255
-        image_response(img_array, event_name="toverp")
+        image_response(img_array, event_name="toverp", transport=self.transport)
         buffer_.close()
         plt.close("all")
     
@@ -643,17 +1434,22 @@ class XemACOMViewerNamespace(Namespace):
         buffer_.seek(0)
         img = PIL.Image.open(buffer_)
         img_array =  np.asarray(img) /255
-        image_response(img_array, event_name="toverp")
+        image_response(img_array, event_name="toverp", transport=self.transport)
         buffer_.close()
         plt.close("all")
         
         
 socketio.on_namespace(RDFNamespace("/rdf"))
-socketio.on_namespace(ViewerNamespace("/viewer"))
+# 其它命名空间通过查看器的后台任务进行中心校正（见 wait_for_centring）
+viewer_namespace = ViewerNamespace("/viewer")
+socketio.on_namespace(viewer_namespace)
 socketio.on_namespace(CenterCalibrationNamespace("/center_calibration"))
 socketio.on_namespace(XemSimulatorNamespace("/sim"))
 socketio.on_namespace(XemACOMViewerNamespace("/xem"))
 
 if __name__ == "__main__":
-    
+    # 删除未正常退出的进程遗留的临时内存映射文件；退出时先关闭所有数据集，
+    # 释放内存映射，本进程的临时文件随后在 Spill_Files 的 atexit 中删除
+    Spill_Files.remove_stale()
+    atexit.register(Dataset_Registry.close)
     socketio.run(app, debug=False, host="127.0.0.1", port=5000)
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("hyperspy")
+pytest.importorskip("py4DSTEM")
+pytest.importorskip("ncempy")
+pytest.importorskip("loguru")
+
+from DM4Processor import DM4Processor  # noqa: E402
+
+
+def brute_force_mean(cube, y, x, h, w):
+    if h < 0:
+        y, h = y + h, -h
+    if w < 0:
+        x, w = x + w, -w
+    frames = cube[max(y, 0) : max(y + h, 0), max(x, 0) : max(x + w, 0)]
+    return frames.reshape((-1,) + cube.shape[2:]).mean(axis=0, dtype=np.float64)
+
+
+def test_pyramid_rect_mean_matches_brute_force():
+    rng = np.random.default_rng(0)
+    cube = rng.random((37, 29, 6, 5)).astype(np.float32)
+    plain = DM4Processor.from_array(cube)
+    pyramid = DM4Processor.from_array(cube)
+    assert pyramid.build_pyramid()
+
+    for _ in range(200):
+        y, x = rng.integers(-8, 40), rng.integers(-8, 32)
+        h, w = rng.integers(-20, 40), rng.integers(-20, 40)
+        y0, y1, x0, x1 = plain._clip_rect(y, x, h, w)
+        if y0 >= y1 or x0 >= x1:
+            expected = np.zeros(cube.shape[2:])
+        else:
+            expected = brute_force_mean(cube, y, x, h, w)
+        for dataset in (plain, pyramid):
+            mean = dataset.get_rect_mean(y, x, h, w)
+            np.testing.assert_allclose(mean, expected, rtol=1e-5)
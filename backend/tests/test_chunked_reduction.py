@@ -0,0 +1,32 @@
+import threading
+import time
+
+from ChunkedReduction import ChunkedReducer
+
+
+def run_counting(reducer, n_items, item_bytes):
+    """Results of ``reducer.map`` and the most calls that ran at once."""
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def fn(item):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return item * item
+
+    return reducer.map(fn, range(n_items), item_bytes), running[1]
+
+
+def test_large_items_run_fewer_at_a_time():
+    reducer = ChunkedReducer(max_workers=4, chunk_bytes=100)
+    results, peak = run_counting(reducer, 20, item_bytes=200)
+    assert results == [i * i for i in range(20)]
+    assert peak <= 2
+
+    results, peak = run_counting(reducer, 20, item_bytes=1000)
+    assert results == [i * i for i in range(20)]
+    assert peak == 1
@@ -0,0 +1,54 @@
+import zlib
+
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+
+from FrameStream import DeltaEncoder, stream_indices  # noqa: E402
+
+
+def decode(frames):
+    """Client side of DeltaEncoder: add each delta to the previous frame."""
+    previous = None
+    for kind, shape, payload in frames:
+        pixels = np.frombuffer(zlib.decompress(payload), dtype=np.uint8)
+        pixels = pixels.reshape(shape)
+        if kind == "delta":
+            pixels = pixels + previous
+        previous = pixels
+        yield pixels
+
+
+def test_delta_stream_round_trip():
+    rng = np.random.default_rng(0)
+    frames = rng.random((70, 16, 12)).astype(np.float32)
+    encoder = DeltaEncoder(keyframe_interval=8)
+    encoded = [encoder.encode(frame) for frame in frames]
+    kinds = [kind for kind, _, _ in encoded]
+    assert kinds[0] == "key" and kinds[9] == "key" and "delta" in kinds
+    for frame, decoded in zip(frames, decode(encoded)):
+        np.testing.assert_array_equal(decoded, (frame * 255).astype(np.uint8))
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        {"path": []},
+        {"start": 5, "stop": 5},
+        {"start": 9, "stop": 3},
+        {"start": 20},
+        {"start": -1},
+        {"row": 4},
+        {"path": [[0, 3]]},
+    ],
+)
+def test_invalid_or_empty_playback_is_rejected(spec):
+    with pytest.raises(ValueError):
+        stream_indices(spec, (4, 3))
+
+
+def test_playback_indices():
+    assert stream_indices({"row": 1}, (4, 3)) == [3, 4, 5]
+    assert stream_indices({"path": [[1, 2], [0, 0]]}, (4, 3)) == [5, 0]
+    assert stream_indices({"start": 10, "step": 1}, (4, 3)) == [10, 11]
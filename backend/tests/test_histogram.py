@@ -0,0 +1,45 @@
+import numpy as np
+
+from Histogram import Histogram
+
+
+def test_merge_of_blocks_equals_histogram_of_all_data():
+    rng = np.random.default_rng(0)
+    blocks = [
+        rng.normal(100, 5, 5000),
+        rng.normal(3000, 50, 5000),
+        np.array([-7.5, 1e6]),
+    ]
+    merged = Histogram()
+    for block in blocks:
+        merged = merged.merge(Histogram.of(block))
+    data = np.concatenate(blocks)
+    assert merged.total == data.size
+    assert len(merged.counts) <= merged.max_bins
+    # Same grid as the merged histogram: the counts agree exactly
+    edges = merged.edges
+    expected, _ = np.histogram(data, bins=edges)
+    np.testing.assert_array_equal(merged.counts, expected)
+
+
+def test_percentiles_lie_between_the_neighbouring_samples():
+    data = np.random.default_rng(1).gamma(2.0, 50.0, 100_000)
+    histogram = Histogram.of(data)
+    q = np.array([0.5, 5, 50, 95, 99.5])
+    ordered = np.sort(data)
+    # Within a bin of the samples on either side of the exact percentile
+    k = q / 100 * (data.size - 1)
+    lower = ordered[np.floor(k).astype(int)] - histogram.width
+    upper = ordered[np.ceil(k).astype(int)] + histogram.width
+    percentiles = histogram.percentiles(q)
+    assert np.all((lower <= percentiles) & (percentiles <= upper))
+
+
+def test_equalize_maps_to_cumulative_frequency():
+    data = np.random.default_rng(2).exponential(10.0, 20_000)
+    equalized = Histogram.of(data).equalize(data)
+    assert equalized.dtype == np.float32
+    assert 0 <= equalized.min() and equalized.max() <= 1
+    # Equalized values are roughly uniform
+    counts, _ = np.histogram(equalized, bins=10, range=(0, 1))
+    np.testing.assert_allclose(counts / data.size, 0.1, atol=0.01)
@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("hyperspy")
+pytest.importorskip("py4DSTEM")
+pytest.importorskip("ncempy")
+pytest.importorskip("loguru")
+
+from DM4Processor import DM4Processor  # noqa: E402
+from IngestCache import IngestCache, Ingest_Cache  # noqa: E402
+
+
+def make_cube(path, scan=(3, 4), detector=128):
+    """Gaussian direct beam whose position drifts across the scan."""
+    yy, xx = np.mgrid[:detector, :detector]
+    cube = np.empty(scan + (detector, detector), dtype=np.float32)
+    for y in range(scan[0]):
+        for x in range(scan[1]):
+            cy, cx = detector / 2 + 3 * y - 4, detector / 2 + 2 * x - 3
+            cube[y, x] = 100 * np.exp(-((yy - cy) ** 2 + (xx - cx) ** 2) / 18) + 1
+    np.save(path, cube)
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_reopened_dataset_shows_centred_frames(tmp_path, monkeypatch, lazy):
+    monkeypatch.setattr(Ingest_Cache, "cache_dir", str(tmp_path / "cache"))
+    path = str(tmp_path / "scan.npy")
+    make_cube(path)
+
+    fresh = DM4Processor()
+    fresh.load_file(path, lazy=lazy)
+    assert fresh.center_direct_beam()
+
+    reopened = DM4Processor()
+    reopened.load_file(path, lazy=lazy)
+    # Cache hit: the shifts are known, the centred view is rebuilt from them
+    assert reopened.shifts is not None
+    assert reopened.needs_centring()
+    assert reopened.center_direct_beam()
+
+    for index in range(12):
+        np.testing.assert_allclose(reopened.get_img(index), fresh.get_img(index))
+    np.testing.assert_allclose(reopened.get_mean_img(), fresh.get_mean_img())
+
+
+def test_failed_store_leaves_no_partial_entry(tmp_path, monkeypatch):
+    path = str(tmp_path / "scan.npy")
+    make_cube(path, detector=32)
+    dataset = DM4Processor()
+    dataset.load_file(path, use_cache=False)
+    cache = IngestCache(cache_dir=str(tmp_path / "cache"))
+
+    def fail(*args):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(cache, "_write", fail)
+    assert cache.store(path, dataset) is None
+    assert cache.entries() == []
+    assert not any(name.endswith(".tmp") for name in os.listdir(cache.cache_dir))
+
+
+def test_store_prunes_least_recently_used_entries(tmp_path):
+    cache = IngestCache(cache_dir=str(tmp_path / "cache"))
+    paths = []
+    for name in ["a", "b", "c"]:
+        path = str(tmp_path / f"{name}.npy")
+        make_cube(path, detector=32)
+        dataset = DM4Processor()
+        dataset.load_file(path, use_cache=False)
+        paths.append(path)
+        entry = cache.store(path, dataset)
+        size = os.path.getsize(entry)
+        # Distinct modification times, oldest first
+        os.utime(entry, ns=(len(paths) * 10**9, len(paths) * 10**9))
+    cache.open(paths[0]).close()
+
+    cache.max_bytes = 2 * size
+    cache.prune()
+    assert cache.open(paths[1]) is None
+    for path in (paths[0], paths[2]):
+        cache.open(path).close()
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("hyperspy")
+pytest.importorskip("py4DSTEM")
+pytest.importorskip("ncempy")
+pytest.importorskip("loguru")
+
+from DM4Processor import DM4Processor  # noqa: E402
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+@pytest.mark.parametrize("dtype", [None, "float32"])
+def test_signed_data_normalizes_without_overflow(tmp_path, lazy, dtype):
+    cube = np.zeros((2, 2, 4, 4), dtype=np.int16)
+    cube[0, 0, 0, :] = [-30000, 30000, 0, 15000]
+    path = str(tmp_path / "scan.npy")
+    np.save(path, cube)
+
+    dataset = DM4Processor()
+    dataset.load_file(
+        path, is_normalize=True, lazy=lazy, normalize_dtype=dtype, use_cache=False
+    )
+    frame = dataset.get_img(0)
+    expected = (cube[0, 0].astype(np.float64) + 30000) / 60000
+    if dtype is None:
+        assert frame.dtype == np.int16
+        top = np.iinfo(np.int16).max
+        assert frame.min() == 0 and frame.max() == top
+        # Rounding happens in float32, ties may go either way
+        np.testing.assert_allclose(frame, expected * top, atol=1)
+    else:
+        assert frame.min() >= 0 and frame.max() <= 1
+        np.testing.assert_allclose(frame, expected, atol=1e-6)
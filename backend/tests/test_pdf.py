@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("polarTransform")
+pytest.importorskip("abtem")
+
+import utils  # noqa: E402
+from utils import calculate_pdf, is_uniform, r_grid  # noqa: E402
+
+
+def direct_pdf(s, phi, r):
+    return np.array([np.sum(phi * np.sin(2 * np.pi * s * rk)) for rk in r])
+
+
+@pytest.mark.parametrize("r_min, r_max", [(0.0, 10.0), (1.3, 7.9)])
+def test_czt_branch_matches_direct_sine_sum(r_min, r_max):
+    s = np.linspace(0.05, 1.6, 2048)
+    phi = np.random.default_rng(0).standard_normal(len(s)) * np.exp(-s)
+    r = r_grid(r_min, r_max, 1024)
+    # Large enough to take the chirp-z branch
+    assert len(s) * len(r) >= utils.PDF_CZT_MIN_SIZE
+    assert is_uniform(s) and is_uniform(r)
+    expected = direct_pdf(s, phi, r)
+    pdf = calculate_pdf(s, phi, r)
+    assert np.max(np.abs(pdf - expected)) <= 1e-8 * np.max(np.abs(expected))
+
+
+def test_matmul_branch_matches_direct_sine_sum(monkeypatch):
+    # Small chunks so several blocks of the sine matrix are used
+    monkeypatch.setattr(utils, "PDF_CHUNK_SIZE", 1000)
+    s = np.sort(np.random.default_rng(1).uniform(0.05, 1.6, 300))
+    phi = np.cos(5 * s)
+    r = r_grid(0.5, 12.0, 200)
+    np.testing.assert_allclose(
+        calculate_pdf(s, phi, r), direct_pdf(s, phi, r), atol=1e-9
+    )
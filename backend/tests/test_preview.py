@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("hyperspy")
+pytest.importorskip("py4DSTEM")
+pytest.importorskip("ncempy")
+pytest.importorskip("loguru")
+
+from DM4Processor import BinnedFrames, DM4Processor  # noqa: E402
+
+
+def test_preview_bins_single_frames_until_the_binned_cube_exists():
+    cube = np.random.default_rng(0).random((3, 4, 64, 64)).astype(np.float32)
+    dataset = DM4Processor.from_array(cube)
+
+    view = dataset.get_preview(16)
+    assert isinstance(view, BinnedFrames)
+    assert not dataset.has_binned(view.factor)
+    assert view.get_shape() == (3, 4, 16, 16)
+    assert view.load_id != dataset.load_id
+
+    binned = dataset.get_binned(view.factor)
+    assert dataset.get_preview(16) is binned
+    for index in range(12):
+        np.testing.assert_allclose(view.get_img(index), binned.get_img(index))
+
+
+def test_binned_copy_of_a_lazy_cube_is_spilled_and_removed(tmp_path):
+    path = str(tmp_path / "scan.npy")
+    np.save(path, np.ones((2, 3, 32, 32), dtype=np.float32))
+    dataset = DM4Processor()
+    dataset.load_file(path, lazy=True, use_cache=False)
+    binned = dataset.get_binned(4)
+    (spill_path,) = dataset._binned_paths
+    assert os.path.exists(spill_path)
+
+    dataset.clear()
+    assert binned.raw_data is None
+    assert not os.path.exists(spill_path)
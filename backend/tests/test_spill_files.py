@@ -0,0 +1,32 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("loguru")
+
+from SpillFiles import SpillFiles  # noqa: E402
+
+
+def test_spill_files_live_in_a_per_process_directory(tmp_path):
+    spill = SpillFiles(root=str(tmp_path))
+    array, path = spill.allocate((2, 3), np.float32)
+    array[:] = 1
+    assert os.path.dirname(path) == spill.directory
+    del array
+    spill.remove([path])
+    assert not os.path.exists(path)
+    spill.cleanup()
+    assert not os.path.exists(spill.directory)
+
+
+def test_stale_directories_are_removed(tmp_path):
+    stale = tmp_path / "99999999"
+    stale.mkdir()
+    (stale / "cube.npy").write_bytes(b"0")
+    spill = SpillFiles(root=str(tmp_path))
+    spill.allocate((1,), np.uint8)
+    spill.remove_stale()
+    assert not stale.exists()
+    assert os.path.isdir(spill.directory)
+    spill.cleanup()
@@ -1,10 +1,17 @@
-import pickle
-
 import numpy as np
 import polarTransform
-from abtem.parametrizations import KirklandParametrization
 from scipy.optimize import leastsq
 from scipy.ndimage import zoom
+from scipy.signal import czt
+
+from ScatteringFactors import Scattering_Factors
+
+# 默认的 r 网格点数
+DEFAULT_R_POINTS = 600
+# r 点数 x s 点数超过该值且两者均为等间距网格时，用 chirp-z 变换计算 PDF
+PDF_CZT_MIN_SIZE = 2**20
+# 矩阵乘法时每块 sin 矩阵的元素数上限
+PDF_CHUNK_SIZE = 2**22
 
 
 def getPath(filename):
@@ -101,30 +108,50 @@ def cut_at_zero(y_fit):
     return indices
 
 
-def calculate_pdf(s, phi, r_ranges):
-    return [np.sum(phi * np.sin(2 * np.pi * s * r)) for r in r_ranges]
+def r_grid(r_min, r_max, r_points=DEFAULT_R_POINTS):
+    """[r_min, r_max) 上 r_points 个等间距的点"""
+    return np.linspace(r_min, r_max, int(r_points), endpoint=False)
 
 
-def get_scattering_factor_function(element_data: list):
-    with open("kirkland.pkl", "rb") as f:
-        kirkland_dict = pickle.load(f)
+def is_uniform(x):
+    if len(x) < 2:
+        return False
+    step = np.diff(x)
+    return step[0] != 0 and np.allclose(step, step[0], rtol=1e-9, atol=0)
 
-    kirkland_param = KirklandParametrization(kirkland_dict)
 
-    element_data_dict = {
-        str(item["atomicNumber"]): item["percentage"] for item in element_data
-    }
-    functions = []
-    for element, percentage in element_data_dict.items():
-        functions.append((kirkland_param.scattering_factor(element), percentage / 100))
+def calculate_pdf(s, phi, r_ranges):
+    """
+    对每个 r 计算 G(r) = sum(phi * sin(2 * pi * s * r))。
 
-    def combined_function(x):
-        return sum(f(x) * p for f, p in functions)
+    小网格用一次（分块的）矩阵乘法；s 和 r 均为等间距的大网格时，用 chirp-z 变换
+    在 O((N + M) log(N + M)) 内精确计算任意起点和步长的 r 网格。
+    """
+    s = np.asarray(s, dtype=np.float64)
+    phi = np.asarray(phi, dtype=np.float64)
+    r = np.asarray(r_ranges, dtype=np.float64)
+    if len(r) * len(s) >= PDF_CZT_MIN_SIZE and is_uniform(s) and is_uniform(r):
+        # sum_j phi_j exp(2 pi i s_j r_k)，s_j = s0 + j ds，r_k = r0 + k dr
+        ds, dr = s[1] - s[0], r[1] - r[0]
+        transform = czt(
+            phi,
+            m=len(r),
+            w=np.exp(2j * np.pi * ds * dr),
+            a=np.exp(-2j * np.pi * ds * r[0]),
+        )
+        return np.imag(np.exp(2j * np.pi * s[0] * r) * transform)
+    pdf = np.empty(len(r), dtype=np.float64)
+    rows = max(1, PDF_CHUNK_SIZE // max(len(s), 1))
+    for start in range(0, len(r), rows):
+        chunk = r[start : start + rows]
+        sines = np.sin(2 * np.pi * np.multiply.outer(chunk, s))
+        pdf[start : start + rows] = sines @ phi
+    return pdf
 
-    def combined_function_sq(x):
-        return sum(f(x) ** 2 * p for f, p in functions)
 
-    return (combined_function, combined_function_sq)
+def get_scattering_factor_function(element_data: list):
+    """组分的散射因子 f(x) 与 f(x)^2 的加权和，由全局缓存的散射因子表插值得到"""
+    return Scattering_Factors.functions(element_data)
 
 
 def convert_to_polar(image, center):
@@ -0,0 +1,92 @@
+// Images arrive as base64 strings (the default) or, once binary transport has
+// been negotiated with "set_transport", as ArrayBuffers in the chosen codec.
+// imageUrl turns either form into something an <img> or Konva image can load.
+
+const MIME = {
+  png: "image/png",
+  webp: "image/webp",
+  jpeg: "image/jpeg",
+};
+
+// Raw frames: uint16 (height, width, channels, 0) header, then uint8 pixels
+const rawToUrl = (buffer) => {
+  const [height, width, channels] = new Uint16Array(buffer.slice(0, 8));
+  const pixels = new Uint8Array(buffer, 8);
+  const canvas = document.createElement("canvas");
+  canvas.width = width;
+  canvas.height = height;
+  const ctx = canvas.getContext("2d");
+  const imageData = ctx.createImageData(width, height);
+  const rgba = imageData.data;
+  for (let i = 0, p = 0; i < width * height; i++, p += channels) {
+    if (channels === 1) {
+      rgba[4 * i] = rgba[4 * i + 1] = rgba[4 * i + 2] = pixels[p];
+    } else {
+      // BGR order, as sent by OpenCV
+      rgba[4 * i] = pixels[p + 2];
+      rgba[4 * i + 1] = pixels[p + 1];
+      rgba[4 * i + 2] = pixels[p];
+    }
+    rgba[4 * i + 3] = 255;
+  }
+  ctx.putImageData(imageData, 0, 0);
+  return new Promise((resolve) =>
+    canvas.toBlob((blob) => resolve(URL.createObjectURL(blob)))
+  );
+};
+
+export const imageUrl = async (data, codec = "png") => {
+  if (typeof data === "string") {
+    if (data.startsWith("data:") || data.startsWith("blob:")) return data;
+    return `data:${MIME[codec] || MIME.png};base64,${data}`;
+  }
+  if (codec === "raw") return rawToUrl(data);
+  return URL.createObjectURL(new Blob([data], { type: MIME[codec] }));
+};
+
+// Replace the URL held in a ref, releasing the previous object URL
+export const setImageUrl = async (target, data, codec) => {
+  const url = await imageUrl(data, codec);
+  const previous = target.value;
+  target.value = url;
+  if (typeof previous === "string" && previous.startsWith("blob:")) {
+    URL.revokeObjectURL(previous);
+  }
+};
+
+const inflate = async (data) => {
+  const bytes =
+    typeof data === "string"
+      ? Uint8Array.from(atob(data), (c) => c.charCodeAt(0))
+      : new Uint8Array(data);
+  const stream = new Blob([bytes])
+    .stream()
+    .pipeThrough(new DecompressionStream("deflate"));
+  return new Uint8Array(await new Response(stream).arrayBuffer());
+};
+
+// Decoder for "play_frame" messages: zlib-compressed keyframes, and deltas
+// that are added (mod 256) to the previous frame. Frames are decoded in
+// arrival order and resolve to image URLs.
+export const createFrameDecoder = () => {
+  let previous = null;
+  let pending = Promise.resolve();
+  const decode = async (frame) => {
+    const pixels = await inflate(frame.data);
+    if (frame.kind === "delta" && previous) {
+      for (let i = 0; i < pixels.length; i++) {
+        pixels[i] = (pixels[i] + previous[i]) & 255;
+      }
+    }
+    previous = pixels;
+    const [height, width, channels = 1] = frame.shape;
+    const buffer = new Uint8Array(8 + pixels.length);
+    new Uint16Array(buffer.buffer, 0, 4).set([height, width, channels, 0]);
+    buffer.set(pixels, 8);
+    return rawToUrl(buffer.buffer);
+  };
+  return (frame) => {
+    pending = pending.then(() => decode(frame));
+    return pending;
+  };
+};